@@ -28,12 +28,35 @@ Usage:
             'encoding', 'err', 'IP',
             'Country', 'Region', 'City', 'Lat', 'Lon',
             'ISP', 'OrgName'
+    IpDemographics.prefetch(ip_addresses, ...)
+        Looks up many addresses concurrently, ahead of calls to
+        ip_info() which then don't have to wait.
+    IpRangeDemographics(file_name)
+        A class with ip_info and prefetch methods like those of
+        IpDemographics but which uses a local table of IP ranges
+        rather than a web site.
+    DemographicsCache(path)
+        A class: an instance provided to IpDemographics as its 'cache'
+        parameter keeps results (in an sqlite file) from one run to
+        the next.
     LIST_OF_IPS(line)
         An re.compile(..).findall function
         Returns a list.  (i.e. Allows input to contain >1 IP/line.)
         Generally log files report only one IP per line unless a 
         reverse look up is provided in which case the second one
         is the same IP but with the dotted quads in reverse order.
+    list_of_ip6s(line, prefix_len=128)
+        Returns a list of the IPv6 addresses in line (normalised) or,
+        if prefix_len is less than 128, of the networks (CIDR blocks
+        such as 2001:db8:1:2::/64) they belong to.  Quick to find none
+        in a line with no IPv6 address.
+    get_ip_ranges(line)
+        Returns a list of (first, last, ) integer tuples, one for each
+        CIDR block (1.2.3.0/24) or range (1.2.3.0-1.2.3.255) in line.
+        IPv6 blocks and ranges (2001:db8::/32) too.
+    IpRanges
+        A class: a collection of such ranges merged into a table which
+        supports 'ip in instance' in O(log n).
     LINE_TYPES : a list of strings. Provides our SPoT (or DRY.)
     get_log_info(line)
         Returns a tuple: line_type, data_gleaned.  
@@ -49,6 +72,24 @@ Usage:
     get_log_files(dir_iterable)
         # accepts an iterable of directory names.
         # returns a list of all file names containing '.log'.
+    find_log_files(directories, include=('*.log*', ), exclude=(),
+                   newer=None, min_size=0, max_size=None, seen=None)
+        # As get_log_files but choosing files by name (shell style
+        # patterns,) modification time and size; each file only once
+        # (by inode) and the largest first.
+    open_log(file_name, background=False)
+        # Opens a log file for reading as text, decompressing it
+        # as it's read if it's compressed (gzip, bz2 or xz.)
+    compression_of(file_name)
+        # Returns 'gzip', 'bz2', 'lzma' or None.
+    lines_with_ips(file_name, start=0, end=None)
+        # Generates only those lines (of a plain file) which appear
+        # to contain an IP address, scanning a memory map of the file.
+    timestamp(line)
+        # Returns the date and time at the beginning of an auth.log or
+        # fail2ban.log line as seconds since the epoch (the time being
+        # taken as UTC) or None.  Fast: each distinct date and time
+        # is only parsed once.
     sortable_date(line)
         # Deals with two issues:
         #   1. Date representations differ.
@@ -63,24 +104,51 @@ Usage:
     sortable_ip(ip)
         # Useful as a key function for sorting.
         # Quietly returns None if parameter is bad.
+    ip_as_int(ip), int_as_ip(n)
+        # Convert between dotted quad and 32 bit integer (or IPv6
+        # address and 128 bit integer, always > IP4_MAX.)
+        # ip_as_int raises ValueError if the parameter is bad.
+    ip_block(ip)
+        # Returns (first, last, ) integers for an IP or CIDR block.
 
 """
 
 __all__ = ['LIST_OF_IPS', 
+          'list_of_ip6s',
+          'get_ip_ranges',
+          'IpRanges',
           'IpDemographics',
+          'IpRangeDemographics',
+          'DemographicsCache',
           'LINE_TYPES ',
           'get_log_info',
           'get_header_text',
           'get_log_files',
+          'find_log_files',
+          'open_log',
+          'compression_of',
+          'damaged_log_errors',
+          'lines_with_ips',
           'sortable_date',
-          'sortable_ip'
+          'timestamp',
+          'sortable_ip',
+          'ip_as_int',
+          'int_as_ip',
+          'ip_block',
+          'IP4_MAX',
           ]
 __version__ = '0.2.6'
 
 import re
 import os
-import urllib.request
+import array
+import bisect
 import datetime
+import calendar
+import time
+import io
+import queue
+import threading
 
 LINE_TYPES  = ['invalid_user',   'no_id',     'break_in', 
               'pub_key',        'closed',    'disconnect', 
@@ -124,8 +192,12 @@ HEADER_TEXT["unban"] = "'fail2ban' reporting 'unban's:"
 RE_FORMAT["already_banned"] = r" already banned$"
 HEADER_TEXT["already_banned"] = "'fail2ban' reporting 'already banned's:"
 # SECTION which DEPENDS on 'LINE_TYPES ' CONTINUES...
-for key in LINE_TYPES :
-    RE_SEARCH4[key] = re.compile(RE_FORMAT[key]).search
+def compile_searches():
+    """Fills RE_SEARCH4 (unless already done): compiling is left
+    until the expressions are first needed (see get_log_info.)"""
+    if not RE_SEARCH4:
+        for key in LINE_TYPES :
+            RE_SEARCH4[key] = re.compile(RE_FORMAT[key]).search
 
 KEYS_PROVIDED["invalid_user"] = ["user"]
 KEYS_PROVIDED["no_id"] = []
@@ -149,6 +221,8 @@ def get_log_info(line):
     a tuple: line_type, data_gleaned.  The later is a list if
     there is data gleaned, None if not.
     """
+    if not RE_SEARCH4:
+        compile_searches()
     for line_type in LINE_TYPES :  # Assume a line can only be of 1 type.
         search_result = RE_SEARCH4[line_type](line)
         if search_result:
@@ -173,9 +247,281 @@ r"""
 LIST_OF_IPS = re.compile(IP_EXP, re.VERBOSE).findall
 # list_of_Ips(line) returns a list (could be empty) of IP addresses.
 
+# To identify IPv6 addresses: hex digits and colons which aren't part of
+# something longer (such as '::ffff:1.2.3.4', an IPv4 address which
+# IP_EXP finds, or a time.)  What is found is then checked (see _ip6().)
+IP6_EXP = \
+r"""
+(?<![\w:.])
+[0-9A-Fa-f]{0,4}(?::[0-9A-Fa-f]{0,4}){2,7}
+(?![\w:.])
+"""
+_find_ip6s = re.compile(IP6_EXP, re.VERBOSE).findall
+
+def might_have_ip6(line):
+    """Every IPv6 address contains either '::' or seven ':'s: a line with
+    neither (nearly every line of a log) needn't be searched for one."""
+    return '::' in line or line.count(':') >= 7
+
+def list_of_ip6s(line, prefix_len=128):
+    """Returns a list (could be empty) of the IPv6 addresses in line,
+    normalised (lower case, zeros compressed) so that each address has
+    only one form.  If prefix_len is less than 128, each address is
+    replaced by the network of that length to which it belongs, given
+    as a CIDR block (2001:db8:1:2::/64.)  Addresses in ::/96 (such as
+    ::1) or mapping IPv4 addresses are left out (see ip_as_int().)"""
+    if not might_have_ip6(line):
+        return []
+    ret = []
+    for text in _find_ip6s(line):
+        ip = _ip6(text, prefix_len)
+        if ip:
+            ret.append(ip)
+    return ret
+
+_ip6s = {}  # _ip6()'s results keyed by its parameters.
+_ip6s_max = 100000  # Emptied when it has this many entries.
+
+def _ip6(text, prefix_len):
+    """Returns what list_of_ip6s() makes of text or None if it isn't
+    an IPv6 address it can use.  Each distinct text is only looked at
+    once (the ipaddress module isn't quick.)"""
+    key = (text, prefix_len, )
+    try:
+        return _ip6s[key]
+    except KeyError:
+        pass
+    import ipaddress
+    try:
+        n = int(ipaddress.IPv6Address(text))
+    except ValueError:
+        n = 0
+    if prefix_len < 128:
+        n &= ~((1 << (128 - prefix_len)) - 1)
+    if n <= IP4_MAX or n >> 32 == 0xffff:
+        ip = None
+    elif prefix_len < 128:
+        ip = "{0}/{1}".format(int_as_ip(n), prefix_len)
+    else:
+        ip = int_as_ip(n)
+    if len(_ip6s) >= _ip6s_max:
+        _ip6s.clear()
+    _ip6s[key] = ip
+    return ip
+
+# To identify blocks of IP addresses (ipv4) given either as
+# CIDR (10.0.0.0/8) or as a range (10.0.0.0-10.255.255.255.)
+RANGE_EXP = \
+r"""
+\b
+(?P<first>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})
+(?:
+  /(?P<prefix>\d{1,2})\b
+|
+  [ ]*-[ ]*(?P<last>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})
+)
+"""
+_find_ranges = re.compile(RANGE_EXP, re.VERBOSE).finditer
+
+# ... and blocks of IPv6 addresses, in the same two ways.
+RANGE6_EXP = \
+r"""
+(?<![\w:.])
+(?P<first>[0-9A-Fa-f:]{2,39})
+(?:
+  /(?P<prefix>\d{1,3})\b
+|
+  [ ]*-[ ]*(?P<last>[0-9A-Fa-f:]{2,39})(?![\w:.])
+)
+"""
+_find_ranges6 = re.compile(RANGE6_EXP, re.VERBOSE).finditer
+
+def get_ip_ranges(line):
+    """Returns a list (could be empty) of (first, last, ) tuples of
+    integers (see ip_as_int()) for the CIDR blocks and ranges of IP
+    addresses (IPv4 or IPv6) found in line.  Anything invalid is
+    ignored."""
+    ranges = []
+    matches = list(_find_ranges(line))
+    if might_have_ip6(line):
+        matches.extend(_find_ranges6(line))
+    for match in matches:
+        try:
+            if match.group('prefix'):
+                first, last = ip_block("{0}/{1}".format(
+                                match.group('first'), match.group('prefix')))
+            else:
+                first = ip_as_int(match.group('first'))
+                last = ip_as_int(match.group('last'))
+        except ValueError:
+            continue
+        if first <= last and (first > IP4_MAX) == (last > IP4_MAX):
+            ranges.append((first, last, ))
+    return ranges
+
+class IpRanges(object):
+
+    """A collection of ranges of IP addresses (as returned by
+    get_ip_ranges()) which supports the 'in' operator for IPs given as
+    dotted quads, IPv6 addresses, CIDR blocks (see ip_block()) or
+    integers: true if any of the addresses is in the collection.
+    Once ranges have been added they are merged into tables of sorted,
+    non overlapping intervals (one for IPv4 held in two arrays, one for
+    IPv6) so each test costs O(log n) however many (hundreds of
+    thousands of) prefixes there are.
+    """
+
+    def __init__(self, ranges=()):
+        self.starts = array.array('I')
+        self.ends = array.array('I')
+        self.starts6 = []  # 128 bit integers don't fit in an array.
+        self.ends6 = []
+        self.pending = list(ranges)
+
+    def add(self, first, last):
+        self.pending.append((first, last, ))
+
+    def extend(self, other):
+        """Adds all the ranges of other (another IpRanges instance.)"""
+        self.pending.extend(zip(other.starts, other.ends))
+        self.pending.extend(zip(other.starts6, other.ends6))
+        self.pending.extend(other.pending)
+
+    def merge(self):
+        """Builds the tables; done automatically when needed.
+        IPv4 and IPv6 ranges are merged apart: IPv6 integers start just
+        after IP4_MAX so 240.0.0.0/4 and ::/8 (say) would otherwise be
+        joined as adjacent."""
+        ranges = list(zip(self.starts, self.ends))
+        ranges6 = list(zip(self.starts6, self.ends6))
+        for first, last in self.pending:
+            if first > IP4_MAX:
+                ranges6.append((first, last, ))
+            else:
+                ranges.append((first, last, ))
+        starts, ends = self._merged(ranges)
+        self.starts = array.array('I', starts)
+        self.ends = array.array('I', ends)
+        self.starts6, self.ends6 = self._merged(ranges6)
+        self.pending = []
+
+    @staticmethod
+    def _merged(ranges):
+        """Returns lists of the starts and ends of the sorted, non
+        overlapping intervals covering ranges, (first, last, ) tuples."""
+        ranges.sort()
+        starts = []
+        ends = []
+        for first, last in ranges:
+            if ends and first <= ends[-1] + 1:  # Overlapping or adjacent.
+                if last > ends[-1]:
+                    ends[-1] = last
+            else:
+                starts.append(first)
+                ends.append(last)
+        return starts, ends
+
+    def overlaps(self, first, last):
+        """Returns True if any of the addresses from first to last
+        (integers, both IPv4 or both IPv6) is in the collection."""
+        if self.pending:
+            self.merge()
+        if first > IP4_MAX:
+            starts, ends = self.starts6, self.ends6
+        else:
+            starts, ends = self.starts, self.ends
+        i = bisect.bisect_right(starts, last) - 1
+        return i >= 0 and first <= ends[i]
+
+    def __contains__(self, ip):
+        if isinstance(ip, int):
+            return self.overlaps(ip, ip)
+        try:
+            return self.overlaps(*ip_block(ip))
+        except ValueError:
+            return False
+
+    def __len__(self):
+        if self.pending:
+            self.merge()
+        return len(self.starts) + len(self.starts6)
+
 #################################################################
 # To get demographic info regarding an IP address:
 
+class DemographicsCache(object):
+
+    """A persistent (sqlite) store of the dictionaries returned by
+    IpDemographics.ip_info(), keyed by IP address and web service.
+
+    Entries older than 'ttl' seconds are ignored (and replaced once
+    looked up again.)  Failed lookups (those with an 'err') are kept
+    too, so that an unreachable site or an unknown IP isn't retried
+    every run, but only for 'negative_ttl' seconds.  Once there are more
+    than 'max_entries', those least recently used are evicted by
+    flush(), which also commits: it is called after each batch of
+    puts (see IpDemographics.prefetch) and by close().
+    """
+
+    default_path = "~/.logparser3_cache.sqlite"
+    default_ttl = 7 * 24 * 60 * 60      # A week.
+    default_negative_ttl = 60 * 60      # An hour.
+    default_max_entries = 100000
+
+    def __init__(self, path=default_path, ttl=default_ttl,
+                negative_ttl=default_negative_ttl,
+                max_entries=default_max_entries):
+        import sqlite3
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(os.path.expanduser(path))
+        self.db.execute("""CREATE TABLE IF NOT EXISTS demographics (
+            ip TEXT, service TEXT, info TEXT, failed INTEGER,
+            fetched REAL, used REAL, PRIMARY KEY (ip, service))""")
+        self.db.execute("""CREATE INDEX IF NOT EXISTS lru
+                            ON demographics (used)""")
+        self.db.commit()
+
+    def get(self, ip_address, service):
+        """Returns the cached dictionary or None if there isn't a
+        fresh one."""
+        now = time.time()
+        row = self.db.execute("""SELECT info, failed, fetched
+            FROM demographics WHERE ip = ? AND service = ?""",
+            (ip_address, service, )).fetchone()
+        if not row:
+            return
+        info, failed, fetched = row
+        if now - fetched > (self.negative_ttl if failed else self.ttl):
+            return
+        self.db.execute("""UPDATE demographics SET used = ?
+            WHERE ip = ? AND service = ?""", (now, ip_address, service, ))
+        import json
+        return json.loads(info)
+
+    def put(self, ip_address, service, info):
+        """Stores 'info' (as returned by IpDemographics.ip_info().)"""
+        import json
+        now = time.time()
+        info = dict(info)
+        info['err'] = str(info['err'])  # Possibly an URLError.
+        self.db.execute("""INSERT OR REPLACE INTO demographics
+            VALUES (?, ?, ?, ?, ?, ?)""", (ip_address, service,
+            json.dumps(info), bool(info['err']), now, now, ))
+
+    def flush(self):
+        """Evicts those least recently used beyond 'max_entries' and
+        commits."""
+        with self.db:
+            self.db.execute("""DELETE FROM demographics WHERE rowid IN
+                (SELECT rowid FROM demographics ORDER BY used DESC
+                LIMIT -1 OFFSET ?)""", (self.max_entries, ))
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
 class IpDemographics(object):
 
     """A class to facilitate being able to easily switch from using one url
@@ -186,13 +532,19 @@ class IpDemographics(object):
     default.)
     A default URL (index to) is set but can be over-ridden by an integer
     parameter when initializing.
+    If a DemographicsCache is provided as 'cache', it is consulted
+    before (and updated after) going to the web site.
+    'timeout' (seconds) limits how long each request may take.
+    prefetch() looks up a whole collection of IPs concurrently so that
+    subsequent calls to ip_info() for them return at once.
+    'stats' keeps count of cache hits and misses, of look ups (and how
+    many of them failed) and of the time they took (see fetch().)
     """
 
     default_url = 1
 
     default_encoding = "utf-8"
     charset_re = r"""\bcharset="(?P<encoding>[-\w]+)"""
-    get_encoding = re.compile(charset_re).search
 
     urls = ("hostip",
             "addgadgets",
@@ -228,20 +580,23 @@ class IpDemographics(object):
             Organization[ ]name:&nbsp;</td><td> (?P<OrgName>[ .\w]+)
             """ }
 
-    get_demographics_dic = {\
-        urls[0] : re.compile(info_re_dic[urls[0]],
-                            re.VERBOSE + re.DOTALL),
-        urls[1] : re.compile(info_re_dic[urls[1]],
-                            re.VERBOSE + re.DOTALL)
-                            }
     demo_keys = ('encoding', 'err', 'IP',
         'Country', 'Region', 'City', 'Lat', 'Lon',
         'ISP', 'OrgName', )
 
 
 
-    def __init__(self, url=default_url):
+    def __init__(self, url=default_url, cache=None, timeout=None):
 
+        self.service = IpDemographics.urls[url]
+        self.cache = cache
+        self.timeout = timeout
+        self.prefetched = {}  # Keyed by IP, filled by prefetch().
+        self.stats = {'cache_hits': 0, 'cache_misses': 0,
+                      'fetches': 0, 'errors': 0,
+                      'fetch_time': 0.0, 'max_fetch_time': 0.0, }
+        self.stats_lock = threading.Lock()  # fetch() runs in threads.
+        self.get_encoding = re.compile(IpDemographics.charset_re).search
         self.url_template = IpDemographics.url_dic[\
                                         IpDemographics.urls[url]]
         self.demographics_pattern = re.compile(\
@@ -260,21 +615,51 @@ class IpDemographics(object):
     in which case, it will contain the error and the other values will
     be empty strings.
     """
+        if ip_address in self.prefetched:
+            return self.prefetched[ip_address]
+        if self.cache:
+            ret = self.cache.get(ip_address, self.service)
+            if ret is None:
+                self.stats['cache_misses'] += 1
+                ret = self.fetch(ip_address)
+                self.cache.put(ip_address, self.service, ret)
+            else:
+                self.stats['cache_hits'] += 1
+            return ret
+        return self.fetch(ip_address)
+
+    def fetch(self, ip_address):
+        """Does the work of ip_info() without reference to any cache."""
+        start = time.time()
+        try:
+            return self._fetch(ip_address)
+        finally:
+            elapsed = time.time() - start
+            with self.stats_lock:
+                self.stats['fetches'] += 1
+                self.stats['fetch_time'] += elapsed
+                if elapsed > self.stats['max_fetch_time']:
+                    self.stats['max_fetch_time'] = elapsed
+
+    def _fetch(self, ip_address):
+        import urllib.request  # Slow to import: only when needed.
         ret = {}
         for key in IpDemographics.demo_keys:
             ret[key] = ""
         try:  
             url_response = urllib.request.urlopen(\
-                self.url_template.format(ip_address))
-        except urllib.request.URLError as err_report: 
-            ret['err'] = err_report
+                self.url_template.format(ip_address), timeout=self.timeout)
+            ip_demographics = url_response.read()  # The returned Data.
+        except (urllib.request.URLError, OSError) as err_report: 
+            ret['err'] = err_report  # OSError: typically a time out.
+            with self.stats_lock:
+                self.stats['errors'] += 1
             return ret
 
-        ip_demographics = url_response.read()  # The returned Data.
         data  = ip_demographics.decode(\
             IpDemographics.default_encoding, "backslashreplace.")
         encoding = \
-            IpDemographics.get_encoding(data).group('encoding')
+            self.get_encoding(data).group('encoding')
         if not encoding:
             encoding = IpDemographics.default_encoding
         if encoding != IpDemographics.default_encoding:
@@ -288,32 +673,250 @@ class IpDemographics(object):
                 except IndexError:
                     pass
         return ret
+
+    def prefetch(self, ip_addresses, workers=8, rate=None, retries=2,
+                                                        backoff=0.5):
+        """Looks up all of 'ip_addresses' (those not already in the
+        cache) using up to 'workers' threads, at most 'rate' requests
+        per second (if specified) and retrying failures (other than a
+        4xx HTTP status) up to 'retries' times, waiting 'backoff'
+        seconds before the first retry and twice as long each time
+        after.  Results are kept for ip_info() (and the cache.)
+        """
+        import concurrent.futures
+        import urllib.request
+        to_fetch = []
+        for ip_address in ip_addresses:
+            if ip_address in self.prefetched:
+                continue
+            if self.cache:
+                ret = self.cache.get(ip_address, self.service)
+                if ret is not None:
+                    self.stats['cache_hits'] += 1
+                    self.prefetched[ip_address] = ret
+                    continue
+                self.stats['cache_misses'] += 1
+            to_fetch.append(ip_address)
+        lock = threading.Lock()
+        next_start = [time.time()]  # When the next request may begin.
+
+        def wait_turn():
+            if not rate:
+                return
+            with lock:
+                start = max(next_start[0], time.time())
+                next_start[0] = start + 1.0 / rate
+            time.sleep(max(0, start - time.time()))
+
+        def fetch_with_retries(ip_address):
+            delay = backoff
+            for attempt in range(retries + 1):
+                wait_turn()
+                ret = self.fetch(ip_address)
+                err = ret['err']
+                if not err or (isinstance(err, urllib.request.HTTPError)
+                                                    and err.code < 500):
+                    break
+                if attempt < retries:
+                    time.sleep(delay)
+                    delay *= 2
+            return ret
+
+        if to_fetch:
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                for ip_address, ret in zip(to_fetch,
+                                pool.map(fetch_with_retries, to_fetch)):
+                    self.prefetched[ip_address] = ret
+                    if self.cache:  # Only used from this thread.
+                        self.cache.put(ip_address, self.service, ret)
+            if self.cache:
+                self.cache.flush()
+
+class IpRangeDemographics(object):
+
+    """An alternative to IpDemographics which needs no network: its
+    ip_info method returns the same dictionary but looks the IP up in a
+    local table of IP ranges such as the free CSV downloads provided by
+    db-ip.com, ip2location.com or iptoasn.com.
+
+    Each line of the file (comma or tab separated; lines beginning
+    with '#' are ignored) begins with the first and last address of a
+    range, either dotted quads or integers, followed by the fields
+    named by 'columns' (any of IpDemographics.demo_keys; by default
+    Country, Region, City, Lat, Lon, ISP and OrgName in that order.)
+    Missing trailing fields are left empty.
+    The ranges are kept as sorted arrays of integers (lists for IPv6)
+    which are searched with bisect so a look up takes microseconds.
+    'stats' keeps count of look ups and of how many found nothing.
+    """
+
+    default_columns = ('Country', 'Region', 'City', 'Lat', 'Lon',
+                                                'ISP', 'OrgName', )
+
+    def __init__(self, file_name, columns=default_columns):
+        import csv
+        self.file_name = file_name
+        self.columns = tuple(columns)
+        ranges = []
+        records = {}  # Many ranges share the same information.
+        with open(file_name, 'r', encoding='utf-8', newline='') as f:
+            first_line = f.readline()
+            f.seek(0)
+            delimiter = '\t' if '\t' in first_line else ','
+            for row in csv.reader(f, delimiter=delimiter):
+                if not row or row[0].startswith('#'):
+                    continue
+                try:
+                    start, end = [int(item) if item.isdigit()
+                            else ip_as_int(item) for item in row[:2]]
+                except ValueError:  # A header line perhaps.
+                    continue
+                record = tuple(row[2:2 + len(self.columns)])
+                ranges.append((start, end, records.setdefault(record,
+                                                            record), ))
+        ranges.sort()
+        n = len([r for r in ranges if r[0] <= IP4_MAX])  # IPv6 follow.
+        self.starts = array.array('I', [r[0] for r in ranges[:n]])
+        self.ends = array.array('I', [r[1] for r in ranges[:n]])
+        self.starts6 = [r[0] for r in ranges[n:]]
+        self.ends6 = [r[1] for r in ranges[n:]]
+        self.records = [r[2] for r in ranges]
+        self.stats = {'lookups': 0, 'errors': 0, }
+
+    def ip_info(self, ip_address):
+        """Returns a dictionary keyed by IpDemographics.demo_keys.
+        'err' is empty unless the IP isn't covered by the table."""
+        ret = {}
+        for key in IpDemographics.demo_keys:
+            ret[key] = ""
+        ret['IP'] = ip_address
+        self.stats['lookups'] += 1
+        try:
+            n = ip_block(ip_address)[0]  # A network by its first address.
+        except ValueError:
+            self.stats['errors'] += 1
+            ret['err'] = "'{0}' is not an IP address".format(ip_address)
+            return ret
+        if n > IP4_MAX:
+            i = bisect.bisect_right(self.starts6, n) - 1
+            found = i >= 0 and n <= self.ends6[i]
+            i += len(self.starts)  # Records of IPv6 follow those of IPv4.
+        else:
+            i = bisect.bisect_right(self.starts, n) - 1
+            found = i >= 0 and n <= self.ends[i]
+        if not found:
+            self.stats['errors'] += 1
+            ret['err'] = "{0} not found in '{1}'".format(ip_address,
+                                                        self.file_name)
+            return ret
+        for key, value in zip(self.columns, self.records[i]):
+            ret[key] = value
+        return ret
+
+    def prefetch(self, ip_addresses, *args, **kwargs):
+        """Nothing to do: look ups are already fast.  Provided so
+        the two classes can be used interchangeably."""
+        pass
 # End of IP demographics gathering section.
 
+IP4_MAX = 0xFFFFFFFF  # Larger integers (see ip_as_int()) are IPv6.
+
+def ip_as_int(ip):
+    """Takes an IP address of the form 50.143.75.105 and returns
+    the 32 bit integer it represents, or of the form 2001:db8::1 and
+    returns the 128 bit integer it represents.  Those in ::/96 (which
+    includes ::1) would be mistaken for IPv4 addresses so aren't
+    accepted: all others are larger than IP4_MAX.
+    Raises ValueError if the parameter is bad."""
+    if ':' in ip:
+        import ipaddress
+        n = int(ipaddress.IPv6Address(ip.strip()))
+        if n <= IP4_MAX:
+            raise ValueError("'{0}' is in ::/96".format(ip))
+        return n
+    parts = ip.strip().split('.')
+    if len(parts) != 4:
+        raise ValueError("'{0}' is not an IPv4 address".format(ip))
+    n = 0
+    for part in parts:
+        part = int(part)
+        if not 0 <= part <= 255:
+            raise ValueError("'{0}' is not an IPv4 address".format(ip))
+        n = (n << 8) | part
+    return n
+
+def int_as_ip(n):
+    """The inverse of ip_as_int(): IPv6 addresses are returned with
+    zeros compressed (2001:db8::1.)"""
+    if n > IP4_MAX:
+        import ipaddress
+        return str(ipaddress.IPv6Address(n))
+    return "{0}.{1}.{2}.{3}".format(n >> 24, (n >> 16) & 255,
+                                        (n >> 8) & 255, n & 255)
+
+def ip_block(ip):
+    """Returns (first, last, ) integers (see ip_as_int()) of the
+    addresses ip stands for: an IP address (first and last being the
+    same) or a CIDR block (10.0.0.0/8 or 2001:db8::/32.)
+    Raises ValueError if the parameter is bad."""
+    address, slash, prefix = ip.partition('/')
+    if not slash:
+        first = ip_as_int(address)
+        return first, first
+    if ':' in address:  # The network itself may be in ::/96 (::/0.)
+        import ipaddress
+        first = int(ipaddress.IPv6Address(address.strip()))
+        bits = 128
+    else:
+        first = ip_as_int(address)
+        bits = 32
+    prefix = int(prefix)
+    if not 0 <= prefix <= bits:
+        raise ValueError("'{0}' is not a CIDR block".format(ip))
+    host_bits = (1 << (bits - prefix)) - 1
+    first &= ~host_bits
+    last = first | host_bits
+    if bits == 128:  # Leave out what would be mistaken for IPv4.
+        first = max(first, IP4_MAX + 1)
+        if last < first:
+            raise ValueError("'{0}' is in ::/96".format(ip))
+    return first, last
+
 def sortable_ip(ip):
     """Takes am IP address of the form 50.143.75.105
     and returns it in the form 050.143.075.105.
+    An IPv6 address (or block: 2001:db8::/32) is returned written out
+    in full (2001:0db8:0000:...) after a ':' so that all of them sort
+    after every IPv4 address (':' follows '9' in ASCII.)
     ... useful as a key function for sorting.
     Quietly returns None if parameter is bad."""
+    if ':' in ip:
+        import ipaddress
+        address, slash, prefix = ip.strip().partition('/')
+        try:
+            address = ipaddress.IPv6Address(address).exploded
+        except ValueError:
+            return None
+        if slash:
+            return ":{0}/{1:0>3}".format(address, prefix)
+        return ":" + address
     parts = ip.strip().split('.')
     if not len(parts)==4:
         return None
     else: 
         return "{0[0]:0>3}.{0[1]:0>3}.{0[2]:0>3}.{0[3]:0>3}".format(parts)
 
-# Some date routines to provide sortable_date().
+# Some date routines to provide sortable_date() and timestamp().
 
 THISYEAR = datetime.date.today().year
 THISMONTH = datetime.date.today().month
 
 def _sample_yr(samplemonth):
     """ auth.log provides date without the year 
-        so we have to "guess."  """
-    tmonth = THISMONTH
-    while tmonth > 0:
-        if samplemonth == tmonth:
-            return THISYEAR
-        tmonth -= 1
+        so we have to "guess": this year unless that would put the
+        sample in a month yet to come. """
+    if samplemonth <= THISMONTH:
+        return THISYEAR
     return THISYEAR -1
 
 
@@ -321,45 +924,315 @@ MONTHS = {"Jan" : 1, "Feb" : 2, "Mar" : 3, "Apr" : 4,
           "May" : 5, "Jun" : 6, "Jul" : 7, "Aug" : 8,
           "Sep" : 9, "Oct" : 10, "Nov" : 11, "Dec" : 12  }
 
+def _log_datetime(log_line):
+    """ Returns the datetime with which an auth.log line
+        ('Dec 23 05:17:01 ...') or a fail2ban.log line
+        ('2013-12-30 01:17:43,514 ...') begins, or None. """
+    try:
+        if log_line[4:5] == '-':  # fail2ban.log
+            year = int(log_line[:4])
+            month = int(log_line[5:7])
+            day = int(log_line[8:10])
+            clock = log_line[11:19]
+        else:  # auth.log
+            month = MONTHS[log_line[:3]]
+            year = _sample_yr(month)
+            day = int(log_line[4:6])
+            clock = log_line[7:15]
+        return datetime.datetime(year, month, day, int(clock[:2]),
+                                    int(clock[3:5]), int(clock[6:8]))
+    except (KeyError, ValueError):
+        return None
+
 def sortable_date(log_line):
     """ Needs to handle all types of log lines. 
         Currently can handle those of: auth.log fail2ban. 
         Returns None if parsing is unsuccessful."""
-    try:   # auth.log 
-        l = log_line[:15].split()
-        return  "%s-%02d-%02d %s" % \
-            (_sample_yr(int(MONTHS[l[0]])), 
-            MONTHS[l[0]], 
-            int(l[1]), l[2], )
-    except:   # TypeError or IndexError
-        pass  # I want ANY error to pass
-    try:  # fail2ban.log
-        l = log_line[:10].split('-')
-        return "%s-%s-%s %s" % \
-            (l[0], l[1], l[2], log_line[11:19], )
-    except:  # Ditto, this might deserve further discussion.
-        return
+    when = _log_datetime(log_line)
+    if when:
+        return when.strftime("%Y-%m-%d %H:%M:%S")
+
+_timestamps = {}  # Cache used by timestamp(), keyed by the
+_timestamps_max = 100000  # text of the date and time.
+
+def timestamp(log_line):
+    """ Returns the date and time with which an auth.log or fail2ban.log
+        line begins as an integer number of seconds since the epoch
+        (the time being taken as it is, i.e. as UTC) or None.
+        Log files have many lines for each second so the text of
+        each is only parsed once (see _timestamps.) """
+    if log_line[4:5] == '-':
+        text = log_line[:19]
+    else:
+        text = log_line[:15]
+    try:
+        return _timestamps[text]
+    except KeyError:
+        pass
+    when = _log_datetime(text)
+    if when:
+        when = calendar.timegm(when.timetuple())
+    if len(_timestamps) >= _timestamps_max:
+        _timestamps.clear()
+    _timestamps[text] = when
+    return when
+
+def find_log_files(directories, include=('*.log*', ), exclude=(),
+                   newer=None, min_size=0, max_size=None, seen=None,
+                   workers=1):
+    """Returns a list of the names of the files beneath (recursively)
+    the given directories whose names match one of the shell style
+    patterns of 'include' and none of 'exclude' (which also applies to
+    the names of directories: those matching aren't looked into.)
+    Files modified before 'newer' (seconds since the epoch,) smaller
+    than 'min_size' or larger than 'max_size' (bytes) are left out too.
+    Each file is included only once, however many paths lead to it
+    (links, bind mounts,) and not at all if its (device, inode, ) is in
+    'seen' (a set, to which those of the files returned are added.)
+    Largest files come first (then by name) so that work divided among
+    processes in that order is shared out evenly.
+    Directories are read with os.scandir (so that files needn't be
+    looked at unless their names match.)  If 'workers' is more than
+    one, the trees two levels down (such as /var/log/containers/*) are
+    shared among that many threads: worthwhile when reading directories
+    means waiting (a network file system, a cold cache,) not otherwise.
+    Symbolic links to directories aren't followed and directories which
+    don't exist or can't be read are quietly ignored (as by os.walk.)
+    """
+    import fnmatch
+    included = re.compile('|'.join([fnmatch.translate(pattern)
+                                    for pattern in include])).match
+    excluded = re.compile('|'.join([fnmatch.translate(pattern)
+                                    for pattern in exclude])).match
+    if not exclude:
+        excluded = lambda name: False
+
+    def scan(directory, files, subdirectories):
+        """Adds the wanted files of directory to files, as (size, name,
+        (device, inode, ), ) tuples, and its subdirectories to
+        subdirectories."""
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if excluded(entry.name):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                            continue
+                        if not (included(entry.name) and entry.is_file()):
+                            continue
+                        stat = entry.stat()
+                    except OSError:  # Gone already perhaps.
+                        continue
+                    if (stat.st_size < min_size
+                            or (max_size is not None
+                                and stat.st_size > max_size)
+                            or (newer is not None
+                                and stat.st_mtime < newer)):
+                        continue
+                    files.append((stat.st_size, entry.path,
+                                  (stat.st_dev, stat.st_ino, ), ))
+        except OSError:
+            pass
+
+    def scan_tree(directory):
+        """Returns the wanted files of directory and all beneath it."""
+        files = []
+        directories = [directory]
+        while directories:
+            scan(directories.pop(), files, directories)
+        return files
+
+    # The directories given and those immediately beneath them are read
+    # here; each tree beneath those is then left to one of the threads.
+    found = []
+    subdirectories = []
+    for directory in directories:
+        scan(directory, found, subdirectories)
+    trees = []
+    for directory in subdirectories:
+        scan(directory, found, trees)
+    if workers > 1:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for files in pool.map(scan_tree, trees):
+                found.extend(files)
+    else:
+        for directory in trees:
+            found.extend(scan_tree(directory))
+    found.sort(key=lambda item: (-item[0], item[1], ))
+    if seen is None:
+        seen = set()
+    log_files = []
+    for size, file_name, key in found:
+        if key not in seen:
+            seen.add(key)
+            log_files.append(file_name)
+    return log_files
 
 def get_log_files(dir_iterable):
     """Takes an iterable, assumed to be a list of directories,
     and traverses these directories recursively returning a
     a list of all the file names containing the string '.log'. 
-    The heavy lifting is done by os.walk which silently does 
-    nothing if given a directory that does not exist.
+    The heavy lifting is done by find_log_files() which silently
+    does nothing if given a directory that does not exist.
     """
-    log_files = []
-    for directory in dir_iterable:
-        for dir_name, _, file_list in os.walk(directory):
-            for file_name in file_list:
-                if '.log' in file_name:
-                    d_n = dir_name
-                    while d_n[-1:] == '/':  # To eliminate double slashes.
-                        d_n = d_n[0:-1]
-                    log_files.append('{0}/{1}'.format(d_n, file_name))
-
-                    #print("Directory '{0}':".format(item[0]))
-                    #print("\t{0}".format(l1))
-    return log_files
+    return find_log_files(dir_iterable)
+
+# To read compressed (rotated) log files as they are:
+
+MAGIC = (                  # The leading bytes identifying
+    (b'\x1f\x8b', 'gzip', ),              # each type of
+    (b'BZh', 'bz2', ),                    # compressed file
+    (b'\xfd7zXZ\x00', 'lzma', ),          # we can read.
+    )
+
+def compression_of(file_name):
+    """Returns the name of the module ('gzip', 'bz2' or 'lzma') able
+    to decompress the file, judging by its leading (magic) bytes, or
+    None if it doesn't appear to be compressed."""
+    with open(file_name, 'rb') as f:
+        head = f.read(6)
+    for magic, module_name in MAGIC:
+        if head.startswith(magic):
+            return module_name
+
+def damaged_log_errors():
+    """Returns a tuple of the exceptions raised part way through
+    reading a compressed log which is damaged or cut short (or a plain
+    one which merely begins like a compressed one): OSError (gzip,
+    bz2), EOFError (cut short) and lzma.LZMAError.  lzma is imported
+    only when this is called (as by an except clause, only once there
+    is an exception.)"""
+    import lzma
+    return (OSError, EOFError, lzma.LZMAError)
+
+class _BackgroundReader(io.RawIOBase):
+
+    """A read only, raw binary stream fed by a thread which reads
+    (and so, if f is a decompressing file object, decompresses) f a
+    block at a time, keeping up to 'depth' blocks ahead.  Since zlib,
+    bz2 and lzma release the GIL while decompressing, decompression
+    then overlaps with whatever is done with the data.
+    Closing it (as closing whatever wraps it does) stops the thread,
+    which then closes f, even if not everything has been read."""
+
+    def __init__(self, f, block_size=1024 * 1024, depth=4):
+        self.blocks = queue.Queue(depth)
+        self.block = memoryview(b'')
+        self.at_eof = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._fill,
+                                args=(f, block_size, ), daemon=True)
+        self.thread.start()
+
+    def _fill(self, f, block_size):
+        try:
+            while not self.stopping.is_set():
+                block = f.read(block_size)
+                self.blocks.put(block)
+                if not block:
+                    break
+        except Exception as err:  # Passed on to the reading thread.
+            self.blocks.put(err)
+        finally:
+            f.close()
+
+    def close(self):
+        """Stops the thread: it may be waiting for room in the queue so
+        the queue is emptied (the thread then puts at most one more
+        block before it sees it is to stop.)"""
+        if not self.closed:
+            self.stopping.set()
+            while self.thread.is_alive():
+                try:
+                    while True:
+                        self.blocks.get_nowait()
+                except queue.Empty:
+                    pass
+                self.thread.join(0.01)
+        super().close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.block:
+            if self.at_eof:
+                return 0
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self.at_eof = True
+                return 0
+            self.block = memoryview(block)
+        n = min(len(buffer), len(self.block))
+        buffer[:n] = self.block[:n]
+        self.block = self.block[n:]
+        return n
+
+# Looser than IP_EXP (the core of a dotted quad, no \b) and so quicker
+# to scan for, but any line in which LIST_OF_IPS would find an IP is
+# sure to be found (barring non ASCII digits.)  Likewise for IPv6 (see
+# might_have_ip6()): '::' or the first four of seven colons.
+IP_BYTES_EXP = rb"""\d\.\d{1,3}\.\d{1,3}\.\d|::|[0-9A-Fa-f]:(?:[0-9A-Fa-f]{1,4}:){3}"""
+_search_ip_bytes = re.compile(IP_BYTES_EXP).search
+
+def lines_with_ips(file_name, start=0, end=None):
+    """Generates, decoded (utf-8) and stripped, those lines of a plain
+    (uncompressed) file which begin within the byte range [start, end)
+    (all of them by default) and appear to contain an IP address.
+    The file is memory mapped and searched for IPs as bytes so that no
+    time is spent reading, decoding or splitting up the (usually many)
+    lines which contain none.
+    """
+    import mmap
+    with open(file_name, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if end is None or end > size:
+            end = size
+        if not size or start >= end:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            pos = start
+            if start:  # The rest of a line belonging to a prior chunk.
+                pos = buffer.find(b'\n', start - 1) + 1
+                if not pos:
+                    return
+            while pos < end:
+                found = _search_ip_bytes(buffer, pos)
+                if not found:
+                    return
+                line_start = buffer.rfind(b'\n', pos, found.start()) + 1
+                if not line_start:
+                    line_start = pos
+                if line_start >= end:
+                    return
+                line_end = buffer.find(b'\n', found.end())
+                if line_end < 0:
+                    line_end = size
+                line = buffer[line_start:line_end].decode('utf-8').strip()
+                if line:
+                    yield line
+                pos = line_end + 1
+
+def open_log(file_name, background=False):
+    """Opens a log file for reading as text (utf-8) whether it is
+    plain or compressed by gzip, bzip2 or xz (see compression_of().)
+    Decompression is done as the file is read: nothing is written to
+    disk.  If 'background' is True, decompression is done by another
+    thread (see _BackgroundReader.)  A damaged compressed file raises
+    one of damaged_log_errors() once the damage is reached."""
+    module_name = compression_of(file_name)
+    if not module_name:
+        return open(file_name, 'r', encoding='utf-8')
+    module = __import__(module_name)
+    if background:
+        return io.TextIOWrapper(io.BufferedReader(_BackgroundReader(
+                    module.open(file_name, 'rb'))), encoding='utf-8')
+    return module.open(file_name, 'rt', encoding='utf-8')
 
 def main():
     """ Testing code. """
@@ -7,6 +7,7 @@
 
 """
 import sys
+import os
 import re
 
 
@@ -487,7 +488,121 @@ class Dict(dict):
         return '{%s}' % ',\n '.join('%r: %r' % i for i in sorted(self.items()))
 
 
-def docopt(doc, argv=None, help=True, version=None, options_first=False):
+def parse_doc(doc):
+    """Returns the options and the (fixed) pattern described by `doc`."""
+    options = parse_defaults(doc)
+    pattern = parse_pattern(formal_usage(DocoptExit.usage), options)
+    # [default] syntax for argument is disabled
+    #for a in pattern.flat(Argument):
+    #    same_name = [d for d in arguments if d.name == a.name]
+    #    if same_name:
+    #        a.value = same_name[0].value
+    pattern_options = set(pattern.flat(Option))
+    for options_shortcut in pattern.flat(OptionsShortcut):
+        doc_options = parse_defaults(doc)
+        options_shortcut.children = list(set(doc_options) - pattern_options)
+        #if any_options:
+        #    options_shortcut.children += [Option(o.short, o.long, o.argcount)
+        #                    for o in argv if type(o) is Option]
+    return options, pattern.fix()
+
+
+def dump_parsed(options, pattern):
+    """Returns `options` and `pattern` (as returned by parse_doc()) as
+    plain data which json can store: a list of the distinct leaves
+    and, for the options and the tree, indexes into it, so that
+    load_parsed() restores the leaves shared (see fix_identities())."""
+    leaves = []
+    places = {}  # Keyed by id(leaf).
+
+    def place(leaf):
+        if id(leaf) not in places:
+            places[id(leaf)] = len(leaves)
+            if type(leaf) is Option:
+                leaves.append(['Option', leaf.short, leaf.long,
+                               leaf.argcount, leaf.value])
+            else:
+                leaves.append([type(leaf).__name__, leaf.name, leaf.value])
+        return places[id(leaf)]
+
+    def tree(node):
+        if hasattr(node, 'children'):
+            return [type(node).__name__, [tree(child)
+                                          for child in node.children]]
+        return place(node)
+
+    return {'options': [place(option) for option in options],
+            'pattern': tree(pattern), 'leaves': leaves}
+
+
+def load_parsed(data):
+    """Returns the options and pattern which dump_parsed() returned as
+    `data`.  Raises ValueError (or KeyError, TypeError...) if `data`
+    is not such."""
+    leaf_types = {'Option': Option, 'Argument': Argument,
+                  'Command': Command}
+    branch_types = {'Required': Required, 'Optional': Optional,
+                    'OptionsShortcut': OptionsShortcut,
+                    'OneOrMore': OneOrMore, 'Either': Either}
+    leaves = []
+    for kind, *fields in data['leaves']:
+        if kind == 'Option':
+            leaf = Option(*fields[:3])
+        else:
+            leaf = leaf_types[kind](fields[0])
+        leaf.value = fields[-1]
+        leaves.append(leaf)
+
+    def tree(node):
+        if type(node) is int:
+            return leaves[node]
+        kind, children = node
+        return branch_types[kind](*[tree(child) for child in children])
+
+    return [leaves[i] for i in data['options']], tree(data['pattern'])
+
+
+def cached_parse_doc(doc, cache_dir):
+    """As parse_doc() but the result is kept (as json, see
+    dump_parsed()) in `cache_dir`, in a file named after a hash of
+    `doc`, and read from there by later calls (in this or any other
+    process) with the same `doc`.  A cache file not owned by the
+    effective user, or which others may write to, is ignored: what it
+    holds decides how the command line is understood (its defaults.)
+    Any problem with the cache just means `doc` is parsed again."""
+    import json
+    import stat
+    import zlib
+    key = '{0}\0{1}\0{2}'.format(__version__, sys.version, doc)
+    path = os.path.join(cache_dir, 'docopt-{0:08x}.json'.format(
+                                        zlib.crc32(key.encode('utf-8'))))
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            info = os.fstat(f.fileno())
+            if (info.st_uid == os.geteuid()
+                    and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+                data = json.load(f)
+                if data['key'] == key:  # Not another doc, same hash.
+                    return load_parsed(data)
+    except (OSError, AttributeError, IndexError, KeyError, TypeError,
+            ValueError):
+        pass
+    options, pattern = parse_doc(doc)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        temporary = '{0}.{1}'.format(path, os.getpid())
+        with open(temporary, 'w', encoding='utf-8') as f:
+            data = dump_parsed(options, pattern)
+            data['key'] = key
+            json.dump(data, f)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+    return options, pattern
+
+
+def docopt(doc, argv=None, help=True, version=None, options_first=False,
+           cache_dir=None):
     """Parse `argv` based on command-line interface described in `doc`.
 
     `docopt` creates your command-line interface based on its
@@ -511,6 +626,10 @@ def docopt(doc, argv=None, help=True, version=None, options_first=False):
     options_first : bool (default: False)
         Set to True to require options precede positional arguments,
         i.e. to forbid options and positional arguments intermix.
+    cache_dir : str, optional
+        A directory in which the result of parsing `doc` (which, for a
+        long `doc`, takes much longer than parsing `argv`) is kept so
+        that later runs needn't parse it again.  See cached_parse_doc().
 
     Returns
     -------
@@ -559,23 +678,13 @@ def docopt(doc, argv=None, help=True, version=None, options_first=False):
         raise DocoptLanguageError('More than one "usage:" (case-insensitive).')
     DocoptExit.usage = usage_sections[0]
 
-    options = parse_defaults(doc)
-    pattern = parse_pattern(formal_usage(DocoptExit.usage), options)
-    # [default] syntax for argument is disabled
-    #for a in pattern.flat(Argument):
-    #    same_name = [d for d in arguments if d.name == a.name]
-    #    if same_name:
-    #        a.value = same_name[0].value
+    if cache_dir:
+        options, pattern = cached_parse_doc(doc, cache_dir)
+    else:
+        options, pattern = parse_doc(doc)
     argv = parse_argv(Tokens(argv), list(options), options_first)
-    pattern_options = set(pattern.flat(Option))
-    for options_shortcut in pattern.flat(OptionsShortcut):
-        doc_options = parse_defaults(doc)
-        options_shortcut.children = list(set(doc_options) - pattern_options)
-        #if any_options:
-        #    options_shortcut.children += [Option(o.short, o.long, o.argcount)
-        #                    for o in argv if type(o) is Option]
     extras(help, version, argv, doc)
-    matched, left, collected = pattern.fix().match(argv)
+    matched, left, collected = pattern.match(argv)
     if matched and left == []:  # better error message if left?
         return Dict((a.name, a.value) for a in (pattern.flat() + collected))
     raise DocoptExit()
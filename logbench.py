@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# file: 'logbench.py'
+"""'logbench.py' times logparser3.py, a stage at a time, on synthetic
+log files so that one version (or choice of options) can be compared
+with another before an upgrade is deployed.
+
+An 'auth.log' and a 'fail2ban.log' are generated (in a temporary
+directory unless --dir is given) along with white and black files.
+Their lines have the shapes akparser3.RE_FORMAT recognises; how many
+of each is set by --mix.  A few addresses account for most of the
+attacks (as they do in real logs.)  The same --seed gives the same
+files.
+
+The stages timed are:
+    total     - logparser3.py run from start to finish (including
+                its start up) with the options given by --options.
+    extract   - akparser3.LIST_OF_IPS applied to every log line.
+    classify  - akparser3.get_log_info applied to every log line
+                containing an IP.
+    process   - logparser3's process() applied to every log line
+                (already in memory) and to the white and black files.
+    read      - logparser3's read_files() of the log files: as
+                'process' but reading them (as the options say.)
+    overlaps  - removing white or black listed IPs from the output.
+    sort      - sorting the output (by IP or, with -f, by frequency.)
+    render    - rendering the main body of the report.
+Each stage is run --repeat times; the best (shortest) time is the one
+used for comparisons.  Results are written as JSON.
+
+usage:
+  logbench.py --help
+  logbench.py [--lines <n>] [--ips <n>] [--mix <mix>] [--seed <n>]
+              [--repeat <n>] [--options <opts>] [--dir <dir>]
+              [--compare <jfile> [--tolerance <pct>]]
+              [--output <ofile>]
+
+Options:
+  -h --help  Print the __doc__ string.
+  -n --lines=<n>  Number of lines to generate (shared between the
+                  two log files.)  [default: 200000]
+  --ips=<n>  Number of distinct attacking IPs.  [default: 2000]
+  --mix=<mix>  Comma separated 'line_type=weight' pairs: how often
+               each type of line appears relative to the others.
+               Line types are those of akparser3.LINE_TYPES plus
+               'solo' (an IP in a line of no known type) and 'noise'
+               (a line without an IP.)  Types left out don't appear.
+               [default: invalid_user=30,no_id=10,break_in=10,closed=15,pub_key=2,listening=1,solo=10,ban=5,unban=4,already_banned=3,noise=60]
+  --seed=<n>  Seed for the random choices.  [default: 1]
+  --repeat=<n>  How many times to run each stage.  [default: 3]
+  --options=<opts>  logparser3.py options (other than those naming
+                    files) to use, as a single string.  [default: -rr]
+  --dir=<dir>  Generate (and keep) the files in this directory rather
+               than in a temporary one.
+  --compare=<jfile>  A JSON file written by an earlier run: report how
+                     each stage compares and exit with status 1 if any
+                     is slower by more than --tolerance.
+  --tolerance=<pct>  See --compare.  [default: 10]
+  -o --output=<ofile>  Where the JSON goes.  [default: stdout]
+"""
+
+import sys
+import os
+import datetime
+import json
+import platform
+import random
+import runpy
+import shlex
+import tempfile
+import time
+from docopt import docopt
+import akparser3
+
+LOGPARSER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'logparser3.py')
+LOG_FILE_TYPES = ('--input', '--white', '--black', )  # As logparser3's
+                                                # lf, wf and bf.
+
+# Functions returning a line of each type given the time (a string
+# such as each log file uses), the IP, and a random.Random instance.
+# The 'disconnect' type isn't here: its expression doesn't match the
+# lines sshd actually writes.
+LINE_MAKERS = {
+    "invalid_user": lambda when, ip, rng:
+        "{0} localhost sshd[{1}]: Invalid user {2} from {3}".format(
+            when, rng.randrange(1000, 32768),
+            rng.choice(USER_NAMES), ip),
+    "no_id": lambda when, ip, rng:
+        "{0} localhost sshd[{1}]: Did not receive identification "
+        "string from {2}".format(when, rng.randrange(1000, 32768), ip),
+    "break_in": lambda when, ip, rng:
+        "{0} localhost sshd[{1}]: Address {2} maps to {3}.adsl-pool.cn, "
+        "but this does not map back to the address - POSSIBLE BREAK-IN "
+        "ATTEMPT!".format(when, rng.randrange(1000, 32768), ip,
+            '.'.join(reversed(ip.split('.')))),
+    "pub_key": lambda when, ip, rng:
+        "{0} localhost sshd[{1}]: Accepted publickey for {2} from {3} "
+        "port {4} ssh2".format(when, rng.randrange(1000, 32768),
+            rng.choice(USER_NAMES[:2]), ip, rng.randrange(1024, 65536)),
+    "closed": lambda when, ip, rng:
+        "{0} localhost sshd[{1}]: Connection closed by {2} "
+        "[preauth]".format(when, rng.randrange(1000, 32768), ip),
+    "listening": lambda when, ip, rng:
+        "{0} localhost sshd[{1}]: Server listening on {2} port "
+        "22.".format(when, rng.randrange(1000, 32768), ip),
+    "solo": lambda when, ip, rng:
+        "{0} localhost sshd[{1}]: Failed password for root from {2} "
+        "port {3} ssh2".format(when, rng.randrange(1000, 32768), ip,
+            rng.randrange(1024, 65536)),
+    "noise": lambda when, ip, rng:
+        "{0} localhost CRON[{1}]: pam_unix(cron:session): session "
+        "closed for user root".format(when, rng.randrange(1000, 32768)),
+    "ban": lambda when, ip, rng:
+        "{0} fail2ban.actions: WARNING [ssh] Ban {1}".format(when, ip),
+    "unban": lambda when, ip, rng:
+        "{0} fail2ban.actions: WARNING [ssh] Unban {1}".format(when, ip),
+    "already_banned": lambda when, ip, rng:
+        "{0} fail2ban.actions: WARNING [ssh] {1} already "
+        "banned".format(when, ip),
+    }
+FAIL2BAN_TYPES = ("ban", "unban", "already_banned", )
+
+USER_NAMES = ("alex", "pi", "admin", "test", "oracle", "postgres",
+              "zabbix", "ubuntu", "git", "nagios", "user", "guest", )
+
+MONTH_NAMES = {n: name for name, n in akparser3.MONTHS.items()}
+
+def parse_mix(mix):
+    """Returns the --mix option as a dict of weights keyed by line type.
+    Raises ValueError if it names a type LINE_MAKERS doesn't know."""
+    weights = {}
+    for pair in mix.split(','):
+        line_type, weight = pair.split('=')
+        if line_type not in LINE_MAKERS:
+            raise ValueError("Unknown line type '{0}'.".format(line_type))
+        weights[line_type] = float(weight)
+    return weights
+
+def auth_time(when):
+    """Returns the datetime as auth.log shows it."""
+    return "{0} {1:2d} {2:%H:%M:%S}".format(MONTH_NAMES[when.month],
+                                            when.day, when)
+
+def fail2ban_time(when):
+    """Returns the datetime as fail2ban.log shows it."""
+    return "{0:%Y-%m-%d %H:%M:%S},{1:03d}".format(when,
+                                            when.microsecond // 1000)
+
+def generate(directory, n_lines, n_ips, weights, seed):
+    """Writes 'auth.log', 'fail2ban.log', 'white.txt' and 'black.txt'
+    into directory.  Returns a dict of the files' names keyed by the
+    logparser3.py option each goes with."""
+    rng = random.Random(seed)
+    ips = set()
+    while len(ips) < n_ips:
+        ips.add("{0}.{1}.{2}.{3}".format(rng.randrange(1, 224),
+            rng.randrange(256), rng.randrange(256), rng.randrange(1, 255)))
+    ips = sorted(ips, key=akparser3.sortable_ip)
+    rng.shuffle(ips)
+    # The first few IPs are the most persistent attackers.
+    ip_weights = [1.0 / (rank + 1) for rank in range(n_ips)]
+    line_types = sorted(weights)
+    types = rng.choices(line_types,
+                [weights[line_type] for line_type in line_types], k=n_lines)
+    addresses = rng.choices(ips, ip_weights, k=n_lines)
+    when = datetime.datetime(akparser3.THISYEAR, 1, 1)  # See _sample_yr.
+    names = {name: os.path.join(directory, name) for name in
+                ('auth.log', 'fail2ban.log', 'white.txt', 'black.txt', )}
+    with open(names['auth.log'], 'w') as auth, \
+            open(names['fail2ban.log'], 'w') as fail2ban:
+        for line_type, ip in zip(types, addresses):
+            when += datetime.timedelta(milliseconds=rng.randrange(1, 20000))
+            if line_type in FAIL2BAN_TYPES:
+                fail2ban.write(LINE_MAKERS[line_type](
+                                        fail2ban_time(when), ip, rng))
+                fail2ban.write('\n')
+            else:
+                auth.write(LINE_MAKERS[line_type](auth_time(when), ip, rng))
+                auth.write('\n')
+    # A few known IPs and a block or two in each of white and black.
+    for name, listed in (('white.txt', ips[-10:], ),
+                         ('black.txt', ips[1:n_ips // 50 + 2], ), ):
+        with open(names[name], 'w') as f:
+            for ip in listed:
+                f.write(ip + '\n')
+            f.write("{0}.0.0.0/8\n".format(rng.randrange(224, 240)))
+            f.write("{0}.0.0.0/16\n".format(ips[0].split('.')[0]))
+    return {'--input': [names['auth.log'], names['fail2ban.log']],
+            '--white': [names['white.txt']],
+            '--black': [names['black.txt']], }
+
+def file_arguments(files):
+    """Returns the logparser3.py arguments naming the files."""
+    ret = []
+    for option in LOG_FILE_TYPES:
+        for f_name in files[option]:
+            ret.extend((option, f_name, ))
+    return ret
+
+def run_logparser(options, files):
+    """Runs logparser3.py (in this process, from scratch) writing its
+    report to /dev/null.  Returns the time taken and the LogAnalyzer it
+    used, through which its data can be got at."""
+    argv = (['--quiet', '--output', os.devnull]
+                    + options + file_arguments(files))
+    start = time.perf_counter()
+    namespace = runpy.run_path(LOGPARSER, run_name='logparser3')
+    analyzer = namespace['main'](argv)
+    elapsed = time.perf_counter() - start
+    return elapsed, analyzer
+
+def timed(function, *params):
+    """Returns the time taken by function(*params) and its result."""
+    start = time.perf_counter()
+    result = function(*params)
+    return time.perf_counter() - start, result
+
+def stage_times(lp, files, lines):
+    """Times each stage (but 'total') once, lp being the LogAnalyzer
+    returned by run_logparser().  Returns a dict of times keyed by stage
+    and a dict of counts of what was found."""
+    args = lp.args
+    lf, wf, bf = LOG_FILE_TYPES
+    times = {}
+    counts = {}
+
+    def extract():
+        with_ips = []
+        find = akparser3.LIST_OF_IPS
+        for line in lines:
+            if find(line):
+                with_ips.append(line)
+        return with_ips
+    times['extract'], with_ips = timed(extract)
+    counts['lines'] = len(lines)
+    counts['lines_with_ips'] = len(with_ips)
+
+    def classify():
+        classified = 0
+        get_log_info = akparser3.get_log_info
+        for line in with_ips:
+            if get_log_info(line):
+                classified += 1
+        return classified
+    times['classify'], counts['lines_classified'] = timed(classify)
+
+    def process():
+        lp.reset()
+        process = lp.process
+        for f_name in files[lf]:
+            for line in lines[f_name]:
+                process(line, lf, f_name)
+        lp.read_files([wf, bf])
+    times['process'], junk = timed(process)
+
+    lp.reset()
+    times['read'], junk = timed(lp.read_files, [lf])
+    lp.read_files([wf, bf])
+    counts['ips'] = len(lp.ipDic)
+
+    def overlaps():
+        output_set = set(lp.log_ips)
+        for line in lp.remove_and_report_overlaps(lp.ip_index,
+                        output_set, args['-r'], False):
+            pass
+        return output_set
+    times['overlaps'], output_set = timed(overlaps)
+    counts['output_ips'] = len(output_set)
+
+    def sort():
+        if args['--frequency']:
+            return sorted(output_set, key=lp.order_by_frequency,
+                                                        reverse=True)
+        return lp.sorted_ips(output_set)
+    times['sort'], ips = timed(sort)
+
+    def render():
+        n_chars = 0
+        for instance in lp.output_instances(ips):
+            for line in instance.render(lp, args['-r'], False):
+                n_chars += len(line)
+        return n_chars
+    times['render'], counts['report_chars'] = timed(render)
+    return times, counts
+
+class Lines(list):
+    """The stripped, non empty lines of all the log files (a list)
+    which can also be indexed by file name for those of one file."""
+
+    def __init__(self, f_names):
+        list.__init__(self)
+        self.by_file = {}
+        for f_name in f_names:
+            with open(f_name, encoding='utf-8') as f:
+                self.by_file[f_name] = [line.strip() for line in f
+                                                    if line.strip()]
+            self.extend(self.by_file[f_name])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.by_file[key]
+        return list.__getitem__(self, key)
+
+def benchmark(files, options, repeat):
+    """Returns a dict of lists of times, one per run, keyed by stage,
+    and a dict of counts (see stage_times().)"""
+    lines = Lines(files['--input'])
+    runs = {}
+    for i in range(repeat):
+        elapsed, lp = run_logparser(options, files)
+        runs.setdefault('total', []).append(elapsed)
+        times, counts = stage_times(lp, files, lines)
+        for stage, elapsed in times.items():
+            runs.setdefault(stage, []).append(elapsed)
+    return runs, counts
+
+def compare(results, earlier, tolerance):
+    """Returns a report (a list of lines) on how the stages' best times
+    compare with those of earlier results, and whether any is more than
+    tolerance percent slower."""
+    report = ["{0:<10} {1:>10} {2:>10} {3:>8}".format(
+                            'stage', 'before', 'now', 'change')]
+    slower = False
+    for stage, data in results['stages'].items():
+        if stage not in earlier['stages']:
+            continue
+        before = earlier['stages'][stage]['best']
+        now = data['best']
+        change = 100.0 * (now - before) / before if before else 0.0
+        flag = ''
+        if change > tolerance:
+            slower = True
+            flag = '  SLOWER'
+        report.append("{0:<10} {1:>10.4f} {2:>10.4f} {3:>+7.1f}%{4}".format(
+                                    stage, before, now, change, flag))
+    return report, slower
+
+def main():
+    args = docopt(__doc__)
+    n_lines = int(args['--lines'])
+    n_ips = int(args['--ips'])
+    seed = int(args['--seed'])
+    repeat = int(args['--repeat'])
+    try:
+        weights = parse_mix(args['--mix'])
+    except ValueError as err_report:
+        sys.exit("Bad --mix: {0}".format(err_report))
+    options = shlex.split(args['--options'])
+    if args['--dir']:
+        directory = args['--dir']
+        os.makedirs(directory, exist_ok=True)
+        temporary = None
+    else:
+        temporary = tempfile.TemporaryDirectory(prefix='logbench')
+        directory = temporary.name
+    try:
+        files = generate(directory, n_lines, n_ips, weights, seed)
+        runs, counts = benchmark(files, options, repeat)
+        results = {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'akparser3': akparser3.__version__,
+            'corpus': {'lines': n_lines, 'ips': n_ips, 'mix': weights,
+                       'seed': seed,
+                       'bytes': sum(os.path.getsize(f_name)
+                                    for f_name in files['--input'])},
+            'options': options,
+            'counts': counts,
+            'stages': {stage: {'best': min(times), 'times': times}
+                                        for stage, times in runs.items()},
+            }
+    finally:
+        if temporary:
+            temporary.cleanup()
+    text = json.dumps(results, indent=2) + '\n'
+    if args['--output'] == 'stdout':
+        sys.stdout.write(text)
+    else:
+        with open(args['--output'], 'w') as f:
+            f.write(text)
+    if args['--compare']:
+        with open(args['--compare']) as f:
+            earlier = json.load(f)
+        report, slower = compare(results, earlier,
+                                    float(args['--tolerance']))
+        sys.stderr.write('\n'.join(report) + '\n')
+        if slower:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
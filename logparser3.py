@@ -10,11 +10,29 @@ from STDIN and reported to STDOUT.
 usage:
   logparser3.py --help
   logparser3.py --version
-  logparser3.py  [-qvfd]
+  logparser3.py --merge <mfile> <snapshot>...
+  logparser3.py  [-qvfdsp]
                 [-r | -rr ]
+                [--sample <n>]
+                [--jobs <n>]
+                [--state <sfile>] [--pipeline] [--mmap]
+                [--follow [--threshold <n>] [--interval <secs>]
+                    [--ipset <name>]]
+                [--cache <cfile> | --no-cache | --geo-db <gfile>]
+                [--demo-workers <n>] [--demo-timeout <secs>]
+                [--demo-rate <n>] [--demo-retries <n>]
+                [--stats] [--stats-json <jfile>] [--profile <pfile>]
+                [--format <fmt>] [--nft-table <table>] [--maxelem <n>]
+                [--top <k>] [--min-hits <n>]
+                [-t] [--since <when>] [--until <when>] [--burst <rate>]
+                [--v6-prefix <len>]
                 [--white <wfile>...]
                 [--black <bfile>...]
                 [--input <ifile>...]
+                [--include <glob>...] [--exclude <glob>...]
+                [--newer <when>] [--min-size <size>] [--max-size <size>]
+                [--export <efile> [--host <name>]]
+                [--import <snapshot>... [--min-hosts <n>]]
                 [--output <ofile>]
 
 Options:
@@ -26,12 +44,32 @@ Options:
           2 - Addresses, number of appearances, type of appearances,
               and additional information if available.
   -d --demographics  Include location/origin of IP if possible.
+  --cache=<cfile>  File in which demographics (see -d) are kept from one
+                   run to the next so that IPs seen recently need not
+                   be looked up again.
+                   [default: ~/.logparser3_cache.sqlite]
+  --no-cache  Always look up demographics; neither use nor update
+              the cache file.
+  --geo-db=<gfile>  Get demographics from this local table of IP ranges
+                    (CSV: first IP, last IP, Country, Region, City, Lat,
+                    Lon, ISP, OrgName) rather than from a web site.
+  --demo-workers=<n>  How many demographic look ups may be under way
+                      at once.  [default: 8]
+  --demo-timeout=<secs>  Give up on a demographic look up after this
+                         many seconds.  [default: 10]
+  --demo-rate=<n>  Begin at most this many demographic look ups per
+                   second; 0 for no limit.  [default: 0]
+  --demo-retries=<n>  How many times to retry a failed demographic look
+                      up, waiting longer each time.  [default: 2]
   -q --quiet  Supress reporting of success list, file access errors,
               or files devoid of IPs.
   -v --verbose  Report any known ('white' or 'black') IPs
                 that have been removed from output.
   -w --white=<wfile>  Specify 0 or more files containing white listed IPs.
   -b --black=<bfile>  Specify 0 or more files containing black listed IPs.
+                      As well as single IPs, these may contain blocks of
+                      IPs as CIDR (10.0.0.0/8) or ranges
+                      (10.0.0.0-10.255.255.255.)
   -i --input=<ifile>  Specify 0 or more input files [default: sys.stdin]
                       If any are provided, stdin is ignored.
                       These are typically log files but don't have to be.
@@ -39,10 +77,168 @@ Options:
                       with names ending in the suffix '.log' 
                       beneath that directory are considered as though
                       separately specified.
+                      Files compressed by gzip, bzip2 or xz (such as
+                      rotated logs) are decompressed as they are read.
+                      Files beneath a directory are read largest first
+                      (which shares work out evenly with -j) and any
+                      reached by more than one path (or also named)
+                      only once.  With -j, that many threads look
+                      for them.
+  --include=<glob>  Instead of those whose names contain '.log', take
+                    only the files beneath a directory (see -i) whose
+                    names match this shell style pattern (or one of
+                    these patterns.)  [default: *.log*]
+  --exclude=<glob>  Leave out files, and directories, beneath a directory
+                    whose names match this pattern (or one of these.)
+  --newer=<when>  Take only files beneath a directory which have been
+                  modified since this time (as for --since: 7d for the
+                  last week.)
+  --min-size=<size>  Take only files beneath a directory of at least this
+                     many bytes (K, M or G may follow.)  [default: 0]
+  --max-size=<size>  ... and of at most this many.
+  --pipeline  Decompress compressed input files in a separate thread
+              so that decompression overlaps with parsing.
+  --mmap  Memory map plain (uncompressed) files and search them as
+          bytes, only decoding lines which contain an IP address.
+          Much faster on large files of mostly irrelevant lines.
   -o --output=<ofile>  Specify output file.  [default: stdout]
                        If none is provided, output goes to stdout.
   -f --frequency   Sort output by frequency of appearance of IPs
                    (Default is by IP.)
+  --top=<k>  Report only the K IPs (or fewer) which appeared most often
+             in the input files (once any white or black listed IPs
+             have been left out.)  0 for all of them.  [default: 0]
+  --min-hits=<n>  Report only IPs which appeared at least this many
+                  times in the input files.  [default: 1]
+  -t --times  Keep track of when (according to the time at the beginning
+              of each line of auth.log or fail2ban.log) each IP was
+              first and last seen and report it (with -r.)  Implied by
+              --since, --until and --burst.
+  --since=<when>  Leave out input file lines from before this time and
+                  any whose time can't be read.  Either a date and
+                  time (2014-08-24 or 2014-08-24 16:30[:00]) or how
+                  long ago: a number of seconds, minutes, hours or days
+                  (90s, 30m, 12h, 7d.)  Times are as they appear in the
+                  logs (no time zone.)
+  --until=<when>  As --since: leave out lines from this time on.
+  --burst=<rate>  Report only IPs which appeared at least N times
+                  within some period of SECS seconds, given as N/SECS
+                  (e.g. 20/60.)  Appearances are counted by the minute
+                  so SECS is rounded up to whole minutes.
+  -s --stream  Fold each line into one compact record per IP which
+               keeps only per file counts and, rather than every item
+               of additional information (see -rr,) a bounded sample:
+               the most frequent values seen for each line type.
+               Memory then depends on the number of distinct IPs
+               rather than on the number of log entries.
+  --sample=<n>  With -s/--stream, how many of the most frequent values
+                to keep per line type.  [default: 10]
+  -p --packed  Keep IP addresses as 32 (IPv6: 128) bit integers (rather
+               than strings) internally; they are converted back only
+               for the report.  Saves memory and time when there are very
+               many IPs.  Anything that looks like an IP but isn't a
+               valid one (e.g. 300.1.2.3) is ignored and IPs with the
+               same frequency (see -f) are ordered numerically.
+  --v6-prefix=<len>  IPv6 addresses (found as well as IPv4 addresses)
+                     are reported by the network of this prefix length
+                     to which they belong, as a CIDR block, since an
+                     attacker can usually choose from all the addresses
+                     of a /64.  128 to report the addresses themselves.
+                     A network is white or black listed if any part of
+                     it is.  [default: 128]
+  -j --jobs=<n>  Number of worker processes among which the files (or,
+                 if large, pieces of them split at line boundaries)
+                 are shared.  Their results are merged as though all
+                 had been read by one process.  [default: 1]
+  --state=<sfile>  Keep (in sfile) how far each input file has been
+                   read along with what has been gathered from them so
+                   far.  The next run with the same sfile only reads
+                   what has since been added to each input file and
+                   reports on the whole.  A file which has been
+                   renamed, as by logrotate (auth.log to auth.log.1,)
+                   is known by its inode and taken up where it was
+                   left.  One which has been replaced (a new file of
+                   the same name) or truncated is read again from its
+                   beginning.
+                   White and black files are always read in full.
+                   Only complete lines are read so a line still being
+                   written is left for the next run.
+  --follow  Rather than reporting once, keep watching the input files
+            (or stdin) for new lines and, as soon as an IP has appeared
+            in them --threshold times, write a line adding it to an
+            ipset (as understood by 'ipset -exist restore') to the
+            output, unless it is white or black listed.  Input files
+            are followed from their current end (or, with --state, from
+            where the last run stopped; IPs already over the threshold
+            are then written at once.)  Runs until interrupted.
+  --threshold=<n>  See --follow.  [default: 5]
+  --interval=<secs>  With --follow, how often to check the input files
+                     for new lines if inotify is not available (or
+                     nothing has been heard from it.)  [default: 1]
+  --ipset=<name>  The name of the set used by --follow and by the
+                  ipset and nft output formats (see --format.)  IPv6
+                  addresses go in a set of the same name followed by
+                  '-v6' (for ip6tables: type hash:net, family inet6.)
+                  [default: logparser3]
+  --format=<fmt>  What to output: one of
+          plain - The report described here.
+          ipset - Input for 'ipset -exist restore' which replaces the
+                  contents of the --ipset set (creating it if need
+                  be) with the IPs, all at once: a new set is filled
+                  and then swapped for the old one.
+          nft   - Input for 'nft -f' which does the same for the
+                  set named by --ipset in the table named by the
+                  option --nft-table; nft applies it as a single
+                  transaction.
+          json  - A JSON array with an object for each IP: its 'ip',
+                  'count', 'line_types' (a count for each) and, as
+                  requested by -r 2, -t and -d, 'gleaned' (a count of
+                  each item of additional information,) 'first_seen'
+                  and 'last_seen' and 'demographics'.
+          csv   - A header line and then, for each IP, its address,
+                  count, a count for each line type, (with -t) when
+                  first and last seen and (with -d) its demographics.
+                  [default: plain]
+          Other than with 'plain', what precedes the main body of the
+          report (which files were read, -v/--verbose output...) goes
+          to stderr as do --stats.
+  --nft-table=<table>  See --format nft.  [default: inet logparser3]
+  --maxelem=<n>  With --format ipset, the most IPs each set may hold.
+                 'ipset -exist restore' won't re-create an existing set
+                 with a different maxelem so keep to the same value
+                 (changing it means destroying the sets first.)
+                 [default: 65536]
+  --stats  Add to the end of the report how long (wall clock and CPU
+           time) each stage took, how quickly each input file was read
+           (lines are those examined: with --mmap only those with an
+           IP,) how many lines of each type were found, how the
+           demographics look ups fared and the peak memory (resident
+           set size) used.  Input files are not listed with -j/--jobs.
+  --stats-json=<jfile>  Write the same statistics to jfile as JSON.
+  --profile=<pfile>  Run the reading of the input files under cProfile
+                     and save the profile in pfile (to be read with
+                     'python3 -m pstats <pfile>'.)  With -j/--jobs, the
+                     workers are not profiled.
+  --export=<efile>  Once the input files have been read, write what was
+                    found in them to efile, a snapshot: an sqlite file
+                    with a row for each IP giving this host's name, how
+                    many times it appeared (in all and for each line
+                    type) and (with -t) when it was first and last seen.
+                    IPv4 addresses are kept as integers.
+  --host=<name>  The host named in an exported snapshot and counted by
+                 --min-hosts.  The default is this host's name.
+  --import=<snapshot>  Add what snapshots (written on this host or others
+                       by --export or --merge) hold to what is found in
+                       the input files (stdin isn't read unless named.)
+                       Each is reported as an input file.
+                       Only counts (no additional information, see -r)
+                       and times first and last seen (no --burst) are
+                       kept.  Can't be used with --export.
+  --min-hosts=<n>  Report only IPs which were found by at least this
+                   many hosts: those of the imported snapshots and,
+                   for the input files, this one.  [default: 1]
+  --merge=<mfile>  Combine the snapshots which follow into the one
+                   snapshot mfile (with a row for each IP and host.)
 
 Any known IPs can be provided in files specified as containing either
 '--black' or '--white' listed IPs.  These are also read and any IP
@@ -63,31 +259,27 @@ If this scrolls too much, try piping to pager:
 ######  END of USAGE statement.  ######
 import sys
 import os
+import array
+import functools
+import pickle
+import time
+import calendar
+import contextlib
+import copy
+import heapq
+try:
+    import resource
+except ImportError:  # Not on all platforms; peak RSS isn't reported.
+    resource = None
 from docopt import docopt
 import akparser3
 
 ### GLOBALS ###
 
-args = docopt(__doc__, version="logparser3.py v0.2.6")
-
-for f_name in args['--input']:
-    if os.path.isdir(f_name):
-        list_of_log_file_names = akparser3.get_log_files((f_name, ))
-        args['--input'].extend(list_of_log_file_names)
-args['--input'] = [file_name for file_name in args['--input']\
-                                if not os.path.isdir(file_name)]
-
-demographics_getter = akparser3.IpDemographics(1)  # Param controls 
-                                           # which url is used.
-
-if len(args['--input'])>1 and args['--input'][0]==sys.stdin:
-    junk = args['--input'].pop(0)
-
-#_r_int = r = args['-r']                #  Working to
-#_d_bool = d = args['--demographics']   #  remove 
-#_q_bool = q = args['--quiet']          #  these
-#_v_bool = v = args['--verbose']        #  five
-#_f_bool = f = args['--frequency']      #  assignments.
+# Parsing __doc__ takes much longer than the rest of start up so the
+# result is kept (see docopt.cached_parse_doc()) for the next run.
+docopt_cache = os.path.join(os.environ.get('XDG_CACHE_HOME')
+                        or os.path.expanduser('~/.cache'), 'logparser3')
 
 # input file type (itype) can be 'lf', 'wf', or 'bf' (input, white, black)
 arg_file_types = [ "--input", "--white", "--black" ]
@@ -96,135 +288,204 @@ lf = arg_file_types[0]  # log file
 wf = arg_file_types[1]  # white file
 bf = arg_file_types[2]  # black file
 
-## Following 2 dicts are populated by process(line, f_type, f_name):
-
-f_status_dic = {lf:{}, wf:{}, bf:{}}
-# Keep track of existence of input files. Count of IPs keyed by file name.
-# All IPs, including duplicates, are counted.
-#             ------ file type  (f_type)
-#             |   ----- file name  (f_name)
-#             |   |
-#             v   v
-#f_status_dic{ } { } counter
-#This keeps track of total number of IP addresses (including duplicates)
-#found in each of the files processed.
-#This information is used by report_empties()
-
-
-ipDic = { }  #     !! ALL DATA !!
-# Top level key is IP address.
-# Next come dictionaries keyed by file type and then file name.
-# Final values will be: IP_Class objects for log file input,
-#                       integer counter for white and black files.
-#      ----  IP address  (ip)
-#      |   ----- file type  (f_type)
-#      |   |   ----- file name  (f_name)
-#      |   |   |
-#      v   v   v
-#ipDic{ } { } { } data: IP_Class objects for log file input,
-#                       integer count for white and black files.
+_head_size = 256  # See LogAnalyzer.file_state.
 
 _unclassified_IP_indicator = 'solo-IP'
+# Places of the log entry types in IP_Class.counts:
+LINE_TYPE_INDEX = {line_type: i for i, line_type in
+        enumerate(akparser3.LINE_TYPES + [_unclassified_IP_indicator])}
+_no_counts = array.array('Q', [0]) * len(LINE_TYPE_INDEX)  # Copied by
+                                                    # IP_Class.__init__.
 _absence_of_entry_indicator = '-'   ##### NOT BEING USED???
 
-err_message_list = []  # Files => access errors added here.
-success_list = []  # Keep track of successfully opened files.
-success_report = ''
-debug_report ="DEBUGGING REPORT:"
-def debug_append(s):
-    global debug_report
-    debug_report = '\n'.join((debug_report, s, ))
-
 ### END of GLOBAL DATA ### #
 
+def parse_args(argv=None):
+    """Returns the options given by argv (by default sys.argv[1:], see
+    __doc__) as a dictionary keyed as by docopt, with numbers, times
+    and sizes converted: the configuration of a LogAnalyzer.
+    parse_args([]) returns the defaults.  Exits (as docopt does) if
+    any of them isn't valid."""
+    args = docopt(__doc__, argv, version="logparser3.py v0.2.6",
+                                                cache_dir=docopt_cache)
+    args['--sample'] = int(args['--sample'])
+    args['--jobs'] = int(args['--jobs'])
+    args['--top'] = int(args['--top'])
+    args['--min-hits'] = int(args['--min-hits'])
+    args['--min-hosts'] = int(args['--min-hosts'])
+    args['--v6-prefix'] = int(args['--v6-prefix'])
+    if not 1 <= args['--v6-prefix'] <= 128:
+        sys.exit("--v6-prefix must be from 1 to 128.")
+    args['--threshold'] = int(args['--threshold'])
+    args['--maxelem'] = int(args['--maxelem'])
+    args['--interval'] = float(args['--interval'])
+    for key in ('--demo-workers', '--demo-retries', ):
+        args[key] = int(args[key])
+    for key in ('--demo-timeout', '--demo-rate', ):
+        args[key] = float(args[key])
+    if len(args['--input'])>1 and args['--input'][0]==sys.stdin:
+        junk = args['--input'].pop(0)
+    if args['--format'] != 'plain' and args['--format'] not in FORMATS:
+        sys.exit("--format must be one of: plain, {0}.".format(
+                                            ', '.join(sorted(FORMATS))))
+    try:
+        for key in ('--since', '--until', ):
+            args[key] = parse_when(args[key]) if args[key] else 0
+        if args['--burst']:
+            text = args['--burst']
+            args['--burst'] = tuple([int(n) for n in text.split('/')])
+            if len(args['--burst']) != 2:
+                raise ValueError("'{0}' is not <n>/<secs>.".format(text))
+    except ValueError as err_report:
+        sys.exit("Bad --since, --until or --burst: {0}".format(err_report))
+    if args['--since'] or args['--until'] or args['--burst']:
+        args['--times'] = True
+    try:
+        if args['--newer']:  # As the logs' times (see parse_when()) are,
+            # not as file times (seconds since the epoch) are.
+            args['--newer'] = (parse_when(args['--newer']) + time.time()
+                                    - calendar.timegm(time.localtime()))
+        for key in ('--min-size', '--max-size', ):
+            if args[key] is not None:
+                args[key] = parse_size(args[key])
+    except ValueError as err_report:
+        sys.exit("Bad --newer, --min-size or --max-size: {0}".format(
+                                                            err_report))
+    return args
+
+def _packed_ip(ip):
+    return akparser3.ip_block(ip)[0]  # For a network, its first address.
+
+# The same few IPs appear over and over again in log files.
+packed_ip = functools.lru_cache(maxsize=65536)(_packed_ip)
+
+def packed_ips(ips):
+    """Returns a list of the IPs packed (see packed_ip) leaving out
+    any which aren't valid."""
+    ret = []
+    for ip in ips:
+        try:
+            ret.append(packed_ip(ip))
+        except ValueError:
+            pass
+    return ret
+
+def item_text(item):
+    """Returns the data gleaned from a log line (a list of tuples of
+    strings, see akparser3.get_log_info()) as a single string."""
+    return ' '.join([' '.join(values) for values in item])
+
 class IP_Class (object):
     """ End values of the ipDic for IPs in log file input.
 
     Also used as values in lists prepared for output.
 
-    'other' is a dictionary keyed by log entry types with each value 
-    being either an integer counter (for those with no associated data) 
-    or a list if lists of strings providing the associated data.
-    If it's the latter, (a list), the len() function provides a count.
-    See akparser2.info() which is responsible for collecting the data
-    and self.add_other() which inserts it into an instance of IP_Class.
+    'counts' is an array (of 64 bit counts: imported sums can exceed
+    2**32) holding, for each log entry type (indexed as in
+    LINE_TYPE_INDEX,) the number of lines of that type in which the
+    IP appeared.
+    'gleaned' is a dictionary keyed by those log entry types for which
+    data is gleaned (user names, listeners...)  Each value is a
+    (values, order, ) pair: 'values' is a dictionary keyed by each
+    distinct item of data with its place in the dictionary as value
+    and 'order' is an array of those places, one per line, in the order
+    the lines were found.  An item seen again only costs its place in
+    'order' and the report can still list every item as found.
+    See akparser3.get_log_info() which is responsible for collecting
+    the data and self.add_other() which inserts it into an instance.
     """
 
+    __slots__ = ('ip', 'n', 'counts', 'gleaned', )
+
     def __init__(self, ip):
         self.ip = ip
         self.n = 0
-        self.other = {}
-#        if other == None:
-#            self.other = {}   # Dictionary to be keyed by an item found in
-#                # akparser3.LINE_TYPES  or by <_unclassified_IP_indicator>
-#                # If the later or a former which has no additional data,
-#                # the value is a counter.  Otherwise a list of lists
-#                # containing the data.
-#        else:      # No occassion to use this so far.
-#            self.other = other
-
-    def display(self, r, d):
+        self.counts = _no_counts[:]
+        self.gleaned = {}
+
+    def display(self, analyzer, r, d):
         """ What we choose to display depends on params 'r' and 'd'.
 
         [1] args["-r"] provided as parameter 'r', 
         [2] args["--demographics"] provided as parameter 'd'
+        'analyzer' is the LogAnalyzer to which the instance belongs.
         """
-        report = \
-        '{0: ^16}  {{0: ^5}}\n{{1}}{{2}}'.format(self.ip, self.n)
-    #     ^          ^          ^    ^  
-    #     |          |          |    | 
-    #     |          |          |    >> additional report.
-    #     |          |          >> demographic report.
-    #     |          >> occurences  <--  self.n
-    #     >> IP address
-        occurences_report = ''
-        additional_report = ''
-        demographic_report = ''
-        if args['-r']:  # r > 0          
-            occurences_report = str(self.n)
-        if args['-r'] >= 2:
-            key_list = list(self.keys())
-            key_list.sort()
-            for line_type in key_list:
-                additional_report += "{0: >33}:  {{0}}\n".\
-                                            format(line_type)
-                if type(self.other[line_type])==int:
-                    additional_report = \
-                        additional_report.format(self.other[line_type])
-                else:
+        return ''.join(self.render(analyzer, r, d))
+
+    def render(self, analyzer, r, d):
+        """ Generates, a line at a time, what display() returns.
+
+        IP address, occurences (if r > 0,) demographic report (if d,)
+        additional report (if r >= 2.)
+        """
+        yield '{0: ^16}  {1: ^5}\n'.format(analyzer.ip_text(self.ip),
+                                            str(self.n) if r else '')
+        if r and analyzer.args['--times'] and self.ip in analyzer.ip_times:
+            yield "\tseen {0[0]} .. {0[1]}\n".format(
+                                            analyzer.seen_text(self.ip))
+        if d:
+            # latitude, longitude &/or ISP could be provided as well:
+            yield "\t{0[Country]} {0[Region]} {0[City]}\n\t{0[ISP]}\n".\
+                format(analyzer.demographics_getter.ip_info(
+                                            analyzer.ip_text(self.ip)))
+        if r >= 2:
+            for line_type in sorted(self.keys()):
+                yield "{0: >33}:  {1}\n".format(line_type,
+                                self.counts[LINE_TYPE_INDEX[line_type]])
+                if line_type in self.gleaned:
+                    values, order = self.gleaned[line_type]
+                    items = list(values)
                     #   vvvv  change this to shorten output vvvv
-                    n = 0
-                    for item in self.other[line_type]:
-                        additional_report += "{0: >51}\n".format(item)
-                        n += 1
+                    for i in order:
+                        yield "{0: >51}\n".format(item_text(items[i]))
                     #   ^^^^ change the above to shorten output ^^^^
-                    additional_report = additional_report.format(n)
-        if args['--demographics']:
-            # latitude, longitude &/or ISP could be provided as well:
-            demographic_report = \
-                "\t{0[Country]} {0[Region]} {0[City]}\n\t{0[ISP]}\n".format\
-                            (demographics_getter.ip_info(self.ip))
-        report = report.format(occurences_report,  # {0}
-                               demographic_report, # {1}
-                               additional_report)  # {2}
-        return report
+
+    def record(self, analyzer, r, d):
+        """ Returns what render() shows as a dictionary (see --format):
+        'ip', 'count', 'line_types' (counts keyed by line type) and, if
+        r >= 2, 'gleaned' (for each line type with data, the count of
+        each item keyed by its text,) with -t/--times, 'first_seen' and
+        'last_seen' and, if d, 'demographics'.
+        """
+        ret = {'ip': analyzer.ip_text(self.ip), 'count': self.n,
+               'line_types': {line_type:
+                                self.counts[LINE_TYPE_INDEX[line_type]]
+                                for line_type in sorted(self.keys())}}
+        if r >= 2:
+            ret['gleaned'] = {}
+            for line_type in sorted(self.gleaned):
+                values, order = self.gleaned[line_type]
+                items = list(values)
+                counts = ret['gleaned'][line_type] = {}
+                for i in order:
+                    text = item_text(items[i])
+                    counts[text] = counts.get(text, 0) + 1
+        if analyzer.args['--times'] and self.ip in analyzer.ip_times:
+            ret['first_seen'], ret['last_seen'] = analyzer.seen_text(self.ip)
+        if d:
+            ret['demographics'] = analyzer.demographics_record(self.ip)
+        return ret
 
     def join(self, instance):
         assert self.ip == instance.ip,\
                 "IP_Class.join() can not be called on non matching IPs."
         assert type(instance) == IP_Class,\
                 "IP_Class.join() can only join another instance."
-        assert type(self.other) == type(instance.other),\
-                "IP_Class.join() can only join compatible instances."
         self.n += instance.n
-        self_set = set(self.keys())
-        instance_set = set(instance.keys())
-        overlaps = self_set & instance_set
-        new = instance_set - self_set
-        for key in overlaps:  # Works for both int and lists:
-            self.other[key] += instance.other[key]  
-        for key in new:
-            self.other[key] = instance.other[key]
+        self.counts = array.array('Q', map(int.__add__, self.counts,
+                                                    instance.counts))
+        for line_type, (values, order) in instance.gleaned.items():
+            if line_type not in self.gleaned:
+                self.gleaned[line_type] = (dict(values),
+                                            array.array('I', order), )
+                continue
+            self_values, self_order = self.gleaned[line_type]
+            places = [self_values.setdefault(item, len(self_values))
+                                                    for item in values]
+            if places == list(range(len(places))):  # Same places.
+                self_order.extend(order)
+            else:
+                self_order.extend([places[i] for i in order])
 
     def increment(self):
         self.n += 1
@@ -240,66 +501,1514 @@ class IP_Class (object):
         Whether or not an IP was found is not relevant but we use it
         in the context that one has been found.
         <data_gleaned> is None if no data exists, or a list if it does.
-        This method populates 'other'.
+        This method populates 'counts' and 'gleaned'.
         """
         if not args:
             args = (_unclassified_IP_indicator, None, )
-        if not args[1]:
-            junk = self.other.setdefault(args[0], 0)
-            self.other[args[0]] += 1
-        else:
-            junk = self.other.setdefault(args[0], [])
-            self.other[args[0]].append(args[1])
+        self.counts[LINE_TYPE_INDEX[args[0]]] += 1
+        if args[1]:
+            if args[0] not in self.gleaned:
+                self.gleaned[args[0]] = ({}, array.array('I'), )
+            values, order = self.gleaned[args[0]]
+            item = tuple(args[1])
+            order.append(values.setdefault(item, len(values)))
 
     def keys(self):
-        return list(self.other)
+        return [line_type for line_type, i in LINE_TYPE_INDEX.items()
+                                                    if self.counts[i]]
 
     def values(self, key):
-        return(self.other[key])
-##### End of Class_IP declaration. #####
+        """ Returns the items of data gleaned from lines of type 'key'
+        (in the order found) or, if there are none, the count."""
+        if key in self.gleaned:
+            values, order = self.gleaned[key]
+            items = list(values)
+            return [items[i] for i in order]
+        return self.counts[LINE_TYPE_INDEX[key]]
 
-def order_by_frequency(ip):  
-    """ A KEY function using [ip][lf] as index into ipDic.
+class IP_Summary (object):
+    """ End values of the ipDic when in stream (-s/--stream) mode.
 
-    Returns a tuple suitable for use as a key to sort a list of 
-    IP's by number of times they appear in input log files with 
-    the IP itself as the secondary key. 
+    One instance per IP (rather than an IP_Class per IP and file) holds
+    everything we keep about it:
+    'files' is keyed by (f_type, f_name, ) tuples, values are counts.
+    'counts' is keyed by log entry types, values are counts.
+    'samples' is keyed by those log entry types for which data is
+    gleaned; each value is a dictionary of at most 'sample_size' (see
+    add()) items keyed by the data gleaned with its (approximate) count as
+    value.  When it is full, a new item replaces the least frequent
+    one and inherits its count (the 'space saving' algorithm) so the
+    most frequent items survive.
+    Also used as values in lists prepared for output.
     """
-    n =  0
-    for file_name in ipDic[ip][lf]:
-        n += ipDic[ip][lf][file_name].how_many()
-    return (n, ip, )
-
-def process(line, f_type, f_name):
-    """This function populates f_status_dic and ipDic.
-
-    i.e. it HAS SIDE EFFECTS on those two globals. 
-    It ignores lines that do not contain an IP address but by the same
-    token, it can be assumed that if there is any action, it is because an
-    IP address exists in the line.
+
+    __slots__ = ('ip', 'n', 'files', 'counts', 'samples', )
+
+    def __init__(self, ip):
+        self.ip = ip
+        self.n = 0
+        self.files = {}
+        self.counts = {}
+        self.samples = {}
+
+    def add(self, f_type, f_name, other=None, sample_size=10):
+        """ Folds in an appearance of the IP in file f_name of type
+        f_type.  'other' is as in IP_Class.add_other() and only used
+        (along with self.n) for log files.  'sample_size' is how many
+        items to keep for each line type (see --sample.)
+        """
+        tup = (f_type, f_name, )
+        self.files[tup] = self.files.get(tup, 0) + 1
+        if f_type != lf:
+            return
+        self.n += 1
+        if not other:
+            other = (_unclassified_IP_indicator, None, )
+        line_type, data_gleaned = other
+        self.counts[line_type] = self.counts.get(line_type, 0) + 1
+        if data_gleaned:
+            item = tuple(data_gleaned)
+            sample = self.samples.setdefault(line_type, {})
+            if item in sample:
+                sample[item] += 1
+            elif len(sample) < sample_size:
+                sample[item] = 1
+            else:
+                least = min(sample, key=sample.get)
+                sample[item] = sample.pop(least) + 1
+
+    def display(self, analyzer, r, d):
+        """ Same layout as IP_Class.display() except that with r>=2
+        only the sampled items, each with its count, are listed.
+        """
+        return ''.join(self.render(analyzer, r, d))
+
+    def render(self, analyzer, r, d):
+        """ Generates, a line at a time, what display() returns."""
+        yield '{0: ^16}  {1: ^5}\n'.format(analyzer.ip_text(self.ip),
+                                            str(self.n) if r else '')
+        if r and analyzer.args['--times'] and self.ip in analyzer.ip_times:
+            yield "\tseen {0[0]} .. {0[1]}\n".format(
+                                            analyzer.seen_text(self.ip))
+        if d:
+            yield "\t{0[Country]} {0[Region]} {0[City]}\n\t{0[ISP]}\n".\
+                format(analyzer.demographics_getter.ip_info(
+                                            analyzer.ip_text(self.ip)))
+        if r >= 2:
+            for line_type in sorted(self.counts):
+                yield "{0: >33}:  {1}\n".format(line_type,
+                                                self.counts[line_type])
+                sample = self.samples.get(line_type, {})
+                for item in sorted(sample, key=sample.get, reverse=True):
+                    yield "{0: >51}\n".format("{0} ({1})".format(
+                                            item_text(item), sample[item]))
+
+    def record(self, analyzer, r, d):
+        """ Same as IP_Class.record() except that 'gleaned' has only
+        the sampled items."""
+        ret = {'ip': analyzer.ip_text(self.ip), 'count': self.n,
+               'line_types': {line_type: self.counts[line_type]
+                                for line_type in sorted(self.counts)}}
+        if r >= 2:
+            ret['gleaned'] = {}
+            for line_type in sorted(self.samples):
+                sample = self.samples[line_type]
+                counts = ret['gleaned'][line_type] = {}
+                for item in sorted(sample, key=sample.get, reverse=True):
+                    text = item_text(item)
+                    counts[text] = counts.get(text, 0) + sample[item]
+        if analyzer.args['--times'] and self.ip in analyzer.ip_times:
+            ret['first_seen'], ret['last_seen'] = analyzer.seen_text(self.ip)
+        if d:
+            ret['demographics'] = analyzer.demographics_record(self.ip)
+        return ret
+
+    def join(self, instance, sample_size=10):
+        """ Folds in another instance for the same IP, as gathered
+        from different files or pieces of a file (see -j/--jobs,) keeping
+        at most 'sample_size' items for each line type.
+        """
+        assert self.ip == instance.ip,\
+                "IP_Summary.join() can not be called on non matching IPs."
+        self.n += instance.n
+        for tup in instance.files:
+            self.files[tup] = self.files.get(tup, 0) + instance.files[tup]
+        for line_type in instance.counts:
+            self.counts[line_type] = (self.counts.get(line_type, 0)
+                                        + instance.counts[line_type])
+        for line_type in instance.samples:
+            sample = self.samples.setdefault(line_type, {})
+            for item, count in instance.samples[line_type].items():
+                sample[item] = sample.get(item, 0) + count
+            if len(sample) > sample_size:
+                keep = sorted(sample, key=sample.get,
+                                reverse=True)[:sample_size]
+                self.samples[line_type] = {item: sample[item]
+                                                for item in keep}
+
+    def how_many(self):
+        return self.n
+
+    def keys(self):
+        return list(self.counts)
+
+class LogAnalyzer (object):
+    """ Gathers the IPs found in log files (and in white and black
+    files) and reports on them, as configured by 'args': a dictionary of
+    the options (see __doc__) as returned by parse_args().
+
+    Everything gathered is kept by the instance so several can be used
+    at once and one can be kept by a long running process and fed more
+    as it arrives; what akparser3 compiles and caches is shared by them
+    all.  feed_line() and feed_file() add to what has been gathered,
+    merge() adds what another instance has gathered and results()
+    returns what is to be reported.  main() is the command line.
     """
-    global f_status_dic 
-    global ipDic
-    ip_list = akparser3.LIST_OF_IPS(line)
-    if ip_list:
-        if (f_type == lf) and (len(ip_list)>1):  
-            # Get rid of reverse look up version of IP.
-            ip_list = [ip_list[1]]
-        for ip in ip_list:
-            junk = f_status_dic.setdefault(f_type, {})
-            junk = f_status_dic[f_type].setdefault(f_name, 0)
-            f_status_dic[f_type][f_name] += 1
-            
-            junk = ipDic.setdefault(ip, {})
-            junk = ipDic[ip].setdefault(f_type, {})
-            if f_type==lf:
-                other = akparser3.get_log_info(line)  # Data entered ...
-                junk = ipDic[ip][f_type].setdefault(f_name, IP_Class(ip) )
-                ipDic[ip][f_type][f_name].increment()
-                ipDic[ip][f_type][f_name].add_other(other)  # & here.
-            else:   # f_type is white or black file: just increment.
-                junk = ipDic[ip][f_type].setdefault(f_name, 0)
-                ipDic[ip][f_type][f_name] += 1
+
+    def __init__(self, args=None):
+        if args is None:
+            args = parse_args([])
+        self.args = args
+        self.demographics_cache = None
+        self.demographics_getter = None  # Only set up if it's to be used.
+        if args['--demographics'] and args['--geo-db']:
+            self.demographics_getter = akparser3.IpRangeDemographics(
+                                                        args['--geo-db'])
+        elif args['--demographics']:
+            if not args['--no-cache']:
+                self.demographics_cache = akparser3.DemographicsCache(
+                                                        args['--cache'])
+            self.demographics_getter = akparser3.IpDemographics(1,
+                        cache=self.demographics_cache,  # 1 controls
+                        timeout=args['--demo-timeout'])  # which url is used.
+        self.reset()
+
+    def reset(self):
+        """Forgets everything gathered (but not how it is configured.)"""
+
+        ## Following 2 dicts are populated by process(line, f_type, f_name):
+
+        self.f_status_dic = {lf:{}, wf:{}, bf:{}}
+        # Keep track of existence of input files. Count of IPs keyed by
+        # file name.  All IPs, including duplicates, are counted.
+        #             ------ file type  (f_type)
+        #             |   ----- file name  (f_name)
+        #             |   |
+        #             v   v
+        #f_status_dic{ } { } counter
+        #This keeps track of total number of IP addresses (including
+        #duplicates) found in each of the files processed.
+        #This information is used by report_empties()
+
+        self.ipDic = { }  #     !! ALL DATA !!
+        # Top level key is IP address.
+        # Next come dictionaries keyed by file type and then file name.
+        # Final values will be: IP_Class objects for log file input,
+        #                       integer counter for white and black files.
+        #      ----  IP address  (ip)
+        #      |   ----- file type  (f_type)
+        #      |   |   ----- file name  (f_name)
+        #      |   |   |
+        #      v   v   v
+        #ipDic{ } { } { } data: IP_Class objects for log file input,
+        #                       integer count for white and black files.
+        # In stream (-s/--stream) mode the values are instead IP_Summary
+        # objects, one per IP, whatever the file type.
+
+        self.ip_index = {}  # Kept up to date by process() (see
+        # index_ip()): keyed by (f_type, f_name, ) tuples, values are
+        # sets of the IPs found in that file.
+        self.log_ips = set()  # IPs found in input (log) files and ...
+        self.listed_ips = set()  # ... those found in white or black files.
+        self.ip_times = {}  # Used with -t/--times: keyed by IP, values
+        # are [first, last, buckets, ] lists: the times (in seconds, see
+        # akparser3.timestamp()) the IP was first and last seen in input
+        # (log) files and a dictionary of how many times it was seen
+        # keyed by minute (time // 60.)
+
+        self.ip_totals = {}  # Number of times each IP appeared in input
+        # (log) files (all of them) kept by process() (but for -s/--stream
+        # when IP_Summary keeps it.)
+
+        self.ip_ranges = {}  # CIDR blocks & ranges found in white and
+        # black files.  Keyed by (f_type, f_name, ) tuples, values are
+        # akparser3.IpRanges instances.  Populated by process().
+
+        self.ip_hosts = {}  # Keyed by IP, sets of the hosts of the
+        # imported snapshots (see import_snapshot()) in which it appears.
+
+        self.file_state = {}  # Used with --state: keyed by input file
+        # name, values are (device, inode, offset, head, ) tuples: offset
+        # is how far the file has been read, head is its first (up to)
+        # _head_size bytes.  (Inode numbers get reused so a rotated file
+        # could otherwise pass for the original.)
+        self.file_inodes = {}  # The same values keyed by (device, inode, )
+        # so that a file renamed (rotated) since is found under its new
+        # name.  Only added to: a new file taking the old name must not
+        # hide the renamed one.
+
+        self.stats = {'stages': {}, 'files': {}, }  # See --stats.  Values
+        # of 'stages' are [wall, cpu, ] seconds, keyed by name, in the
+        # order they began; values of 'files' are [lines, bytes, seconds, ]
+        # keyed by name.
+
+        self.err_message_list = []  # Files => access errors added here.
+        self.success_list = []  # Keep track of successfully opened files.
+        self.debug_report = "DEBUGGING REPORT:"
+
+    def close(self):
+        """Closes the demographics cache (if there is one.)"""
+        if self.demographics_cache:
+            self.demographics_cache.close()
+
+    def feed_line(self, line, f_name='sys.stdin', f_type=lf):
+        """Adds what 'line' of the file f_name (of type f_type: by
+        default an input (log) file) holds to what has been gathered.
+        Returns the IPs found in it (see process().)"""
+        line = line.strip()
+        if not line:
+            return []
+        return self.process(line, f_type, f_name)
+
+    def feed_file(self, f_name, f_type=lf):
+        """Reads the file f_name (of type f_type, 'sys.stdin' for stdin)
+        passing each line to process() (see also --state and --mmap.)
+        Returns False if it couldn't be opened (see err_message_list.)"""
+        compression = None
+        if f_name != 'sys.stdin':
+            try:  # Also finds out whether it can be opened.
+                compression = akparser3.compression_of(f_name)
+            except IOError as err_report:
+                self.err_message_list.append(err_report)
+                return False
+        start_time = time.perf_counter()
+        if self.args['--state'] and f_type == lf and f_name != 'sys.stdin':
+            start, end = self.new_range(f_name)
+            n_lines = self.process_range(f_type, f_name, start, end)
+            n_bytes = end - start
+        elif (self.args['--mmap'] and f_name != 'sys.stdin'
+                                                    and not compression):
+            n_bytes = os.path.getsize(f_name)
+            n_lines = self.process_range(f_type, f_name, 0, n_bytes)
+        else:
+            if f_name == 'sys.stdin':
+                f = sys.stdin
+            else:
+                try:
+                    f = akparser3.open_log(f_name, self.args['--pipeline'])
+                except IOError as err_report:
+                    self.err_message_list.append(err_report)
+                    return False
+            n_lines = 0
+            try:
+                for line in f:
+                    n_lines += 1
+                    line = line.strip()
+                    if line:
+                        self.process(line, f_type, f_name)
+            except akparser3.damaged_log_errors() as err_report:
+                self.note_damaged(f_name, err_report)
+            if f_name != 'sys.stdin':
+                f.close()
+                n_bytes = os.path.getsize(f_name)
+            else:
+                n_bytes = None
+        self.add_file_stats(f_name, n_lines, n_bytes,
+                                time.perf_counter() - start_time)
+        self.success_list.append(f_name)
+        return True
+
+    def merge(self, other):
+        """Adds what another LogAnalyzer (configured in the same way)
+        has gathered.  What it holds is taken over rather than copied so
+        'other' should be reset() or discarded afterwards."""
+        self.merge_data(other.ipDic, other.f_status_dic, other.ip_ranges,
+                                                        other.ip_times)
+        for ip, hosts in other.ip_hosts.items():
+            junk = self.ip_hosts.setdefault(ip, set())
+            self.ip_hosts[ip] |= hosts
+        self.success_list.extend(other.success_list)
+        self.err_message_list.extend(other.err_message_list)
+
+    def results(self):
+        """Returns a list with a dictionary (see IP_Class.record()) for
+        each of the IPs to be reported, in order (see output_ips()): what
+        --format json writes."""
+        ips, junk = self.output_ips()
+        return [instance.record(self, self.args['-r'],
+                                self.args['--demographics'])
+                for instance in self.output_instances(ips)]
+
+    def debug_append(self, s):
+        self.debug_report = '\n'.join((self.debug_report, s, ))
+
+    def ip_text(self, ip):
+        """Returns the IP as a dotted quad (or IPv6) string whether or not
+        it has been packed into an integer (see -p/--packed.)"""
+        args = self.args
+        if args['--packed']:
+            if ip > akparser3.IP4_MAX and args['--v6-prefix'] < 128:
+                return "{0}/{1}".format(akparser3.int_as_ip(ip),
+                                        args['--v6-prefix'])
+            return akparser3.int_as_ip(ip)
+        return ip
+
+    def is_ip6(self, ip):
+        """Returns True if the IP (packed or not) is an IPv6 address or
+        network (see --v6-prefix.)"""
+        if self.args['--packed']:
+            return ip > akparser3.IP4_MAX
+        return ':' in ip
+
+    def range_key(self, ip):
+        """Returns what to look for in ip_ranges' values: the IP, but for
+        a packed IPv6 network which has to be given as text for the whole
+        network (rather than its first address) to be looked for."""
+        if (self.args['--packed'] and self.args['--v6-prefix'] < 128
+                and self.is_ip6(ip)):
+            return self.ip_text(ip)
+        return ip
+
+    def sorted_ips(self, ips):
+        """Returns a list of the IPs in the iterable 'ips' sorted by IP."""
+        if self.args['--packed']:
+            return sorted(ips)
+        return sorted(ips, key=akparser3.sortable_ip)
+
+    def demographics_record(self, ip):
+        """Returns the demographics of ip (see -d) as a dictionary of
+        strings."""
+        info = self.demographics_getter.ip_info(self.ip_text(ip))
+        return {key: str(info[key]) for key in
+                    akparser3.IpDemographics.demo_keys if key != 'encoding'}
+
+    def order_by_frequency(self, ip):  
+        """ A KEY function using ip_totals (or, in stream mode, ipDic.)
+
+        Returns a tuple suitable for use as a key to sort a list of 
+        IP's by number of times they appear in input log files with 
+        the IP itself as the secondary key. 
+        """
+        if self.args['--stream']:
+            return (self.ipDic[ip].n, ip, )
+        return (self.ip_totals.get(ip, 0), ip, )
+
+    def process(self, line, f_type, f_name):
+        """This function populates f_status_dic and ipDic.
+
+        i.e. it HAS SIDE EFFECTS on those two attributes. 
+        It ignores lines that do not contain an IP address but by the same
+        token, it can be assumed that if there is any action, it is because an
+        IP address exists in the line.
+        Returns the list of IPs recorded (possibly empty.)
+        """
+        args = self.args
+        ipDic = self.ipDic
+        f_status_dic = self.f_status_dic
+        when = None
+        if f_type == lf and args['--times']:
+            when = akparser3.timestamp(line)
+            if args['--since'] or args['--until']:
+                # Skipped before any more work is done on them.
+                if (when is None or when < args['--since']
+                        or (args['--until'] and when >= args['--until'])):
+                    return []
+        if f_type != lf:
+            for first, last in akparser3.get_ip_ranges(line):
+                tup = (f_type, f_name, )
+                if tup not in self.ip_ranges:
+                    self.ip_ranges[tup] = akparser3.IpRanges()
+                self.ip_ranges[tup].add(first, last)
+        ip_list = akparser3.LIST_OF_IPS(line)
+        if '::' in line or line.count(':') >= 7:  # As might_have_ip6() but
+            # without the cost of a call for every line.
+            ip_list += akparser3.list_of_ip6s(line, args['--v6-prefix'])
+        if ip_list:
+            if (f_type == lf) and (len(ip_list)>1):  
+                # Get rid of reverse look up version of IP.
+                ip_list = [ip_list[1]]
+            if args['--stream'] and f_type == lf:
+                other = akparser3.get_log_info(line)
+            else:
+                other = None
+            if args['--packed']:
+                ip_list = packed_ips(ip_list)
+            for ip in ip_list:
+                junk = f_status_dic.setdefault(f_type, {})
+                junk = f_status_dic[f_type].setdefault(f_name, 0)
+                f_status_dic[f_type][f_name] += 1
+                if when is not None:
+                    self.note_time(ip, when)
+
+                if args['--stream']:
+                    if ip not in ipDic:
+                        ipDic[ip] = IP_Summary(ip)
+                    if (f_type, f_name, ) not in ipDic[ip].files:
+                        self.index_ip(ip, f_type, f_name)
+                    ipDic[ip].add(f_type, f_name, other,
+                                            args['--sample'])
+                    continue
+                junk = ipDic.setdefault(ip, {})
+                junk = ipDic[ip].setdefault(f_type, {})
+                if f_name not in ipDic[ip][f_type]:  # First time in this file.
+                    self.index_ip(ip, f_type, f_name)
+                if f_type==lf:
+                    other = akparser3.get_log_info(line)  # Data entered ...
+                    junk = ipDic[ip][f_type].setdefault(f_name, IP_Class(ip) )
+                    ipDic[ip][f_type][f_name].increment()
+                    self.ip_totals[ip] = self.ip_totals.get(ip, 0) + 1
+                    ipDic[ip][f_type][f_name].add_other(other)  # & here.
+                else:   # f_type is white or black file: just increment.
+                    junk = ipDic[ip][f_type].setdefault(f_name, 0)
+                    ipDic[ip][f_type][f_name] += 1
+        return ip_list
+
+    def note_time(self, ip, when):
+        """Records in ip_times that ip was seen at time 'when' (seconds.)"""
+        times = self.ip_times.get(ip)
+        if times is None:
+            self.ip_times[ip] = [when, when, {when // 60: 1}, ]
+            return
+        if when < times[0]:
+            times[0] = when
+        elif when > times[1]:
+            times[1] = when
+        minute = when // 60
+        times[2][minute] = times[2].get(minute, 0) + 1
+
+    def max_burst(self, ip, seconds):
+        """Returns the most times ip was seen within any period of
+        'seconds' (rounded up to whole minutes, see ip_times.)"""
+        if ip not in self.ip_times:
+            return 0
+        buckets = self.ip_times[ip][2]
+        minutes = sorted(buckets)
+        span = max(1, -(-seconds // 60))
+        most = total = 0
+        j = 0
+        for minute in minutes:
+            total += buckets[minute]
+            while minutes[j] <= minute - span:
+                total -= buckets[minutes[j]]
+                j += 1
+            most = max(most, total)
+        return most
+
+    def seen_text(self, ip):
+        """Returns when ip was first and last seen (see ip_times) as a pair
+        of strings, or None."""
+        if ip not in self.ip_times:
+            return None
+        return tuple([time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(when))
+                                        for when in self.ip_times[ip][:2]])
+
+    def index_ip(self, ip, f_type, f_name):
+        """Records (in ip_index, log_ips and listed_ips) that ip has been
+        found in file f_name of type f_type.  Called by process() (and
+        merge()) only the first time ip is found in a file so that what
+        is done after all the files have been read needn't go through all
+        of ipDic."""
+        tup = (f_type, f_name, )
+        if tup not in self.ip_index:
+            self.ip_index[tup] = set()
+        self.ip_index[tup].add(ip)
+        if f_type == lf:
+            self.log_ips.add(ip)
+        else:
+            self.listed_ips.add(ip)
+
+    def rebuild_index(self):
+        """Sets up ip_index, log_ips, listed_ips and ip_totals afresh
+        from ipDic (as after it has been restored by load_state().)"""
+        self.ip_index = self.create_sets_by_tuple()
+        self.log_ips = raw_output_set(self.ip_index)
+        self.listed_ips = set()
+        for tup in self.ip_index:
+            if tup[0] != lf:
+                self.listed_ips |= self.ip_index[tup]
+        self.ip_totals = {}
+        if not self.args['--stream']:
+            for ip in self.log_ips:
+                self.ip_totals[ip] = sum([instance.how_many()
+                            for instance in self.ipDic[ip][lf].values()])
+
+    def process_range(self, f_type, f_name, start, end):
+        """Passes to process() those lines of the file which begin within
+        the byte range [start, end).
+        A compressed file can't be divided so is read in full (provided
+        start is 0.)
+        Returns the number of lines read (with --mmap only those which
+        were passed on.)
+        """
+        n_lines = 0
+        if akparser3.compression_of(f_name):
+            if not start:
+                try:
+                    with akparser3.open_log(f_name,
+                                        self.args['--pipeline']) as f:
+                        for line in f:
+                            n_lines += 1
+                            line = line.strip()
+                            if line:
+                                self.process(line, f_type, f_name)
+                except akparser3.damaged_log_errors() as err_report:
+                    self.note_damaged(f_name, err_report)
+            return n_lines
+        if self.args['--mmap']:
+            for line in akparser3.lines_with_ips(f_name, start, end):
+                n_lines += 1
+                self.process(line, f_type, f_name)
+            return n_lines
+        with open(f_name, 'rb') as f:
+            if start:
+                f.seek(start - 1)
+                f.readline()  # The rest of a line belonging to a prior chunk.
+            while f.tell() < end:
+                line = f.readline()
+                if not line:
+                    break
+                n_lines += 1
+                line = line.decode('utf-8').strip()
+                if line:
+                    self.process(line, f_type, f_name)
+        return n_lines
+
+    def note_damaged(self, f_name, err_report):
+        """Notes (in err_message_list) that f_name, presumably a damaged
+        compressed file, couldn't be read to the end.  What was read
+        before the damage is kept."""
+        self.err_message_list.append(
+            "'{0}' couldn't be read to the end ({1!r}): the rest ignored."
+            .format(f_name, err_report))
+
+    def merge_data(self, partial_ipDic, partial_f_status_dic,
+                                    partial_ip_ranges, partial_ip_times):
+        """Folds the results of process_chunk() into this instance using
+        the same semantics as IP_Class.join() (IP_Summary.join() in
+        stream mode) and adding up the integer counters."""
+        for ip, (first, last, buckets) in partial_ip_times.items():
+            if ip not in self.ip_times:
+                self.ip_times[ip] = [first, last, buckets, ]
+                continue
+            times = self.ip_times[ip]
+            times[0] = min(times[0], first)
+            times[1] = max(times[1], last)
+            for minute, count in buckets.items():
+                times[2][minute] = times[2].get(minute, 0) + count
+        for tup, ranges in partial_ip_ranges.items():
+            if tup in self.ip_ranges:
+                self.ip_ranges[tup].extend(ranges)
+            else:
+                self.ip_ranges[tup] = ranges
+        for f_type in partial_f_status_dic:
+            for f_name, count in partial_f_status_dic[f_type].items():
+                self.f_status_dic.setdefault(f_type, {})
+                self.f_status_dic[f_type][f_name] = \
+                            self.f_status_dic[f_type].get(f_name, 0) + count
+        for ip, data in partial_ipDic.items():
+            if self.args['--stream']:
+                for f_type, f_name in data.files:
+                    self.index_ip(ip, f_type, f_name)
+                if ip in self.ipDic:
+                    self.ipDic[ip].join(data, self.args['--sample'])
+                else:
+                    self.ipDic[ip] = data
+                continue
+            junk = self.ipDic.setdefault(ip, {})
+            for f_type in data:
+                by_name = self.ipDic[ip].setdefault(f_type, {})
+                for f_name, value in data[f_type].items():
+                    if f_type == lf:
+                        self.ip_totals[ip] = (self.ip_totals.get(ip, 0)
+                                                                + value.n)
+                    if f_name not in by_name:
+                        by_name[f_name] = value
+                        self.index_ip(ip, f_type, f_name)
+                    elif f_type == lf:
+                        by_name[f_name].join(value)
+                    else:
+                        by_name[f_name] += value
+
+    def new_range(self, f_name):
+        """Used with --state: returns the byte range (start, end, ) of the
+        input file f_name not yet read and records that it will have been.
+        'end' follows the last complete line.
+        A file is known by its device and inode as well as by its name so
+        one renamed (rotated: auth.log to auth.log.1) is taken up where
+        it was left, provided it begins as it did."""
+        with open(f_name, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            key = (stat.st_dev, stat.st_ino, )
+            head = f.read(_head_size)
+            entry = self.file_state.get(f_name)
+            if entry is None or entry[:2] != key:  # Renamed?
+                entry = self.file_inodes.get(key, (None, None, 0, b'', ))
+            device, inode, start, old_head = entry
+            if ((device, inode, ) != key or start > stat.st_size
+                    or head[:len(old_head)] != old_head):
+                start = 0  # A different (rotated) or truncated file.
+            end = pos = stat.st_size
+            if akparser3.compression_of(f_name):
+                pos = start  # Read in full or not at all (see process_range.)
+            while pos > start:  # Look for the last end of line.
+                block_start = max(start, pos - 65536)
+                f.seek(block_start)
+                i = f.read(pos - block_start).rfind(b'\n')
+                if i >= 0:
+                    end = block_start + i + 1
+                    break
+                pos = end = block_start
+        self.file_state[f_name] = key + (end, head[:end], )
+        self.file_inodes[key] = self.file_state[f_name]
+        return start, end
+
+    def load_state(self, state_file):
+        """Restores (if state_file exists) what was saved by save_state().
+        A state saved with a different choice of -s/--stream or -p/--packed
+        (or by a version of this program which kept its data differently)
+        can't be used; it is noted as an error and we start afresh."""
+        args = self.args
+        try:
+            with open(state_file, 'rb') as f:
+                state = pickle.load(f)
+            options = state['options']
+            ipDic = state['ipDic']
+            f_status_dic = state['f_status_dic']
+            file_state = state['file_state']
+            file_inodes = {}
+            for device, inode, offset, head in file_state.values():
+                file_inodes[(device, inode, )] = (device, inode, offset,
+                                                                    head, )
+            ip_times = state.get('ip_times', {})
+        except FileNotFoundError:
+            return
+        except (pickle.UnpicklingError, AttributeError, EOFError,
+                KeyError, TypeError, ValueError) as err_report:
+            # EOFError: empty or cut short (by a crash while saving.)
+            self.err_message_list.append(
+                "State file '{0}' can't be used ({1!r}): ignored."
+                .format(state_file, err_report))
+            return
+        if options != (args['--stream'], args['--packed'],
+                                                    args['--v6-prefix'], ):
+            self.err_message_list.append(
+                "State file '{0}' was saved with different options: ignored."
+                .format(state_file))
+            return
+        self.ipDic = ipDic
+        self.f_status_dic = f_status_dic
+        self.file_state = file_state
+        self.file_inodes = file_inodes
+        self.ip_times = ip_times
+        self.rebuild_index()
+
+    def log_file_data(self):
+        """Returns the part of ipDic which was gathered from input (log)
+        files, i.e. leaving out white and black file data."""
+        ret = {}
+        for ip in self.ipDic:
+            if self.args['--stream']:
+                if self.ipDic[ip].n:
+                    summary = IP_Summary(ip)
+                    summary.n = self.ipDic[ip].n
+                    summary.counts = self.ipDic[ip].counts
+                    summary.samples = self.ipDic[ip].samples
+                    summary.files = {tup: count for tup, count
+                            in self.ipDic[ip].files.items() if tup[0] == lf}
+                    ret[ip] = summary
+            elif lf in self.ipDic[ip]:
+                ret[ip] = {lf: self.ipDic[ip][lf]}
+        return ret
+
+    def save_state(self, state_file):
+        """Saves, for use by the next run, what has been gathered from
+        the input files and how far each has been read (see --state.)"""
+        args = self.args
+        state = {'options': (args['--stream'], args['--packed'],
+                                                    args['--v6-prefix'], ),
+                 'ipDic': self.log_file_data(),
+                 'f_status_dic': {lf: self.f_status_dic.get(lf, {})},
+                 'file_state': self.file_state,
+                 'ip_times': self.ip_times, }
+        with open(state_file + '.new', 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(state_file + '.new', state_file)
+
+    def snapshot_ip(self, ip):
+        """Returns the IP (packed or not) as it is kept in a snapshot."""
+        text = self.ip_text(ip)
+        if ':' in text:
+            return text
+        try:
+            return akparser3.ip_as_int(text)
+        except ValueError:  # Such as 300.1.2.3 (which -p leaves out.)
+            return text
+
+    def snapshot_rows(self, host):
+        """Generates a snapshot's rows for the IPs found in the input (log)
+        files."""
+        n_types = len(LINE_TYPE_INDEX)
+        for ip in self.log_ips:
+            if self.args['--stream']:
+                counts = [self.ipDic[ip].counts.get(line_type, 0)
+                                            for line_type in LINE_TYPE_INDEX]
+            else:
+                counts = [0] * n_types
+                for instance in self.ipDic[ip][lf].values():
+                    counts = list(map(int.__add__, counts, instance.counts))
+            first, last = self.ip_times.get(ip, (None, None, ))[:2]
+            yield ([self.snapshot_ip(ip), host, sum(counts)] + counts
+                                                        + [first, last])
+
+    def export_snapshot(self, file_name):
+        """Writes what has been gathered from the input (log) files to the
+        snapshot file_name (see --export.)"""
+        write_snapshot(file_name, lambda db: db.executemany(
+                "INSERT INTO snapshot VALUES ({0})".format(
+                                ', '.join('?' * len(snapshot_columns()))),
+                self.snapshot_rows(self.this_host())))
+
+    def import_snapshot(self, file_name):
+        """Adds what the snapshot file_name holds to ipDic, as though it
+        were an input (log) file of that name in which each IP appeared as
+        often as the snapshot says, and notes in ip_hosts which hosts
+        reported each IP.  Appearances are only counted by line type: no
+        additional information (see -rr) and, with -t, only when first and
+        last seen (so no --burst.)  Raises ValueError as open_snapshot()."""
+        args = self.args
+        import sqlite3
+        db = sqlite3.connect(':memory:')
+        columns = open_snapshot(db, file_name, 'source')
+        line_types = [line_type for line_type in LINE_TYPE_INDEX
+                            if '"{0}"'.format(line_type) in columns]
+        times = 'first_seen' in columns and args['--times']
+        tup = (lf, file_name, )
+        n_ips = 0
+        selected = (['ip', 'GROUP_CONCAT(DISTINCT host)', 'SUM(count)']
+                + ['SUM("{0}")'.format(line_type) for line_type in line_types]
+                + (['MIN(first_seen)', 'MAX(last_seen)'] if times
+                                                    else ['NULL', 'NULL']))
+        for row in db.execute("SELECT {0} FROM source.snapshot GROUP BY ip"
+                                            .format(', '.join(selected))):
+            ip, hosts, n = row[:3]
+            if isinstance(ip, int):
+                ip = akparser3.int_as_ip(ip)
+            if args['--packed']:
+                try:
+                    ip = packed_ip(ip)
+                except ValueError:
+                    continue
+            counts = zip(line_types, row[3:-2])
+            if args['--stream']:
+                if ip not in self.ipDic:
+                    self.ipDic[ip] = IP_Summary(ip)
+                summary = self.ipDic[ip]
+                summary.n += n
+                summary.files[tup] = summary.files.get(tup, 0) + n
+                for line_type, count in counts:
+                    if count:
+                        summary.counts[line_type] = (
+                                summary.counts.get(line_type, 0) + count)
+            else:
+                instance = IP_Class(ip)
+                instance.n = n
+                for line_type, count in counts:
+                    instance.counts[LINE_TYPE_INDEX[line_type]] = count or 0
+                junk = self.ipDic.setdefault(ip, {}).setdefault(lf, {})
+                self.ipDic[ip][lf][file_name] = instance
+                self.ip_totals[ip] = self.ip_totals.get(ip, 0) + n
+            self.index_ip(ip, lf, file_name)
+            junk = self.ip_hosts.setdefault(ip, set())
+            if hosts:
+                self.ip_hosts[ip].update(hosts.split(','))
+            first, last = row[-2:]
+            if first is not None:
+                if ip in self.ip_times:
+                    self.ip_times[ip][0] = min(self.ip_times[ip][0], first)
+                    self.ip_times[ip][1] = max(self.ip_times[ip][1], last)
+                else:
+                    self.ip_times[ip] = [first, last, {}, ]
+            n_ips += n
+        db.close()
+        junk = self.f_status_dic[lf].setdefault(file_name, 0)
+        self.f_status_dic[lf][file_name] += n_ips
+        self.success_list.append(file_name)
+
+    def this_host(self):
+        """Returns the name of this host (see --host.)"""
+        args = self.args
+        if not args['--host']:
+            import socket
+            args['--host'] = socket.gethostname()
+        return args['--host']
+
+    def host_count(self, ip, local_ips):
+        """Returns how many hosts reported ip: those of the imported
+        snapshots (see ip_hosts) and this one if it is among local_ips
+        (those found in the input files themselves.)"""
+        hosts = self.ip_hosts.get(ip, set())
+        if ip in local_ips:
+            hosts = hosts | {self.this_host()}
+        return len(hosts)
+
+    def input_files(self, names):
+        """Returns the input files: those of names which aren't directories
+        (in the same order) followed by the files found beneath those which
+        are (see --include and the options which follow it.)"""
+        args = self.args
+        files = []
+        directories = []
+        seen = set()  # (device, inode, ) of each file.
+        for f_name in names:
+            if os.path.isdir(f_name):
+                directories.append(f_name)
+                continue
+            files.append(f_name)
+            try:
+                stat = os.stat(f_name)
+            except OSError:  # Reported when it's read.
+                continue
+            seen.add((stat.st_dev, stat.st_ino, ))
+        if directories:
+            files.extend(akparser3.find_log_files(directories,
+                    include=args['--include'], exclude=args['--exclude'],
+                    newer=args['--newer'], min_size=args['--min-size'],
+                    max_size=args['--max-size'], seen=seen,
+                    workers=args['--jobs']))
+        return files
+
+    def read_files(self, types):
+        """Reads the files (specified by args) of each of the file
+        types listed in 'types', passing each line to process()."""
+        for arg_file_type in types:
+            for f_name in self.args[arg_file_type]:
+                self.feed_file(f_name, arg_file_type)
+
+    def read_files_in_parallel(self, jobs, types):
+        """Does what read_files() does but shares the work among 'jobs'
+        worker processes.  Files are split into chunks (so that large ones
+        can be shared) in the order in which they would otherwise have
+        been read and the results are merged in that same order; the
+        outcome is therefore identical.
+        stdin can not be shared so is read here.
+        """
+        args = self.args
+        import multiprocessing
+        chunks = []
+        paths = [args[arg_file_type] for arg_file_type in types]
+        total = sum([os.path.getsize(f_name) for names in paths
+                        for f_name in names if os.path.isfile(f_name)])
+        chunk_size = total // (jobs * 4)  # Some slack to balance the load.
+        for arg_file_type in types:
+            for f_name in args[arg_file_type]:
+                if f_name == 'sys.stdin':
+                    for line in sys.stdin:
+                        line = line.strip()
+                        if line:
+                            self.process(line, arg_file_type, f_name)
+                else:
+                    try:
+                        open(f_name, 'r', encoding='utf-8').close()
+                    except IOError as err_report:
+                        self.err_message_list.append(err_report)
+                        continue
+                    if args['--state'] and arg_file_type == lf:
+                        chunks.extend(file_chunks(arg_file_type, f_name,
+                                    chunk_size, *self.new_range(f_name)))
+                    else:
+                        chunks.extend(file_chunks(arg_file_type, f_name,
+                                                            chunk_size))
+                self.success_list.append(f_name)
+        if not chunks:
+            return
+        with multiprocessing.get_context('fork').Pool(jobs,
+                    initializer=start_worker, initargs=(self, )) as pool:
+            for partial in pool.imap(process_chunk, chunks):
+                self.merge_data(*partial[:-1])
+                self.err_message_list.extend(partial[-1])
+
+    def is_listed(self, ip):
+        """Returns True if ip appears in a white or black file, either
+        as such or as part of a block."""
+        if ip in self.listed_ips:
+            return True
+        for ranges in self.ip_ranges.values():
+            if self.range_key(ip) in ranges:
+                return True
+        return False
+
+    def follow(self, outF):
+        """Implements --follow: never returns (until interrupted.)
+
+        White and black files must already have been read.  Each new line
+        of the input files is passed to process() and any IP (not white or
+        black listed) whose count reaches args['--threshold'] is written to
+        outF as an ipset 'add' line.  New lines are found as with --state
+        (see new_range()) so rotated files are picked up from the start.
+        """
+        args = self.args
+        import select
+        emitted = set()
+        line_format = "add {0} {{0}}\n".format(args['--ipset'])
+        line_format6 = "add {0} {{0}}\n".format(self.ipset6_name())
+
+        def check(ips):
+            for ip in ips:
+                if (ip not in emitted
+                        and (self.order_by_frequency(ip)[0]
+                                                >= args['--threshold'])
+                        and not self.is_listed(ip)):
+                    emitted.add(ip)
+                    if self.is_ip6(ip):
+                        outF.write(line_format6.format(self.ip_text(ip)))
+                    else:
+                        outF.write(line_format.format(self.ip_text(ip)))
+            outF.flush()
+
+        check([ip for ip in self.ipDic
+                            if args['--stream'] or lf in self.ipDic[ip]])
+        if args['--input'] == ['sys.stdin']:
+            for line in sys.stdin:
+                line = line.strip()
+                if line:
+                    check(self.process(line, lf, 'sys.stdin'))
+            return
+        if not args['--state']:
+            for f_name in args['--input']:
+                try:
+                    self.new_range(f_name)  # Start from the current end.
+                except IOError:
+                    pass
+        fd = inotify_fd(args['--input'])
+        last_saved = time.time()
+        while True:
+            for f_name in args['--input']:
+                try:
+                    start, end = self.new_range(f_name)
+                except IOError:  # Perhaps in the middle of being rotated.
+                    continue
+                if end == start:
+                    continue
+                with open(f_name, 'rb') as f:
+                    f.seek(start)
+                    while f.tell() < end:
+                        line = f.readline()
+                        if not line:  # Truncated since new_range().
+                            break
+                        line = line.decode('utf-8', 'replace').strip()
+                        if line:
+                            check(self.process(line, lf, f_name))
+            if args['--state'] and time.time() - last_saved > 60:
+                self.save_state(args['--state'])
+                last_saved = time.time()
+            if fd is None:
+                time.sleep(args['--interval'])
+            elif select.select([fd], [], [], args['--interval'])[0]:
+                try:
+                    while os.read(fd, 65536):  # Only a wake up call.
+                        pass
+                except BlockingIOError:
+                    pass
+
+    def create_sets_by_tuple(self):
+        """Returns a dictionary with values as sets, 
+        keyed by (f_type, f_name, ) tuples. 
+        The sets contain the IPs gleaned from that 
+        particular file.
+        (This is what process() keeps up to date as ip_index; it is only
+        used to set that up again from a restored ipDic.)
+        """
+        sets = {} 
+        for ip in self.ipDic:
+            if self.args['--stream']:
+                for tup in self.ipDic[ip].files:
+                    junk = sets.setdefault(tup, set()  )
+                    sets[tup].add(ip)
+                continue
+            for f_type in self.ipDic[ip]:
+                for f_name in self.ipDic[ip][f_type]:
+                    tup = (f_type, f_name, )
+                    junk = sets.setdefault(tup, set()  )
+                    sets[tup].add(ip)
+        return sets
+
+    def create_output_class_list(self, output_collection):
+        """Sets up the list of IP_Class instances for output.
+    
+        Assumes output_collection contains IPs that were found 
+        in an input log file and therefore will have IP_Class 
+        instances associated with corresponding entries in ipDic.
+        Note that 'output_collection' can be any iterable whose 
+        values are IPs that exist in ipDic with a log file index.
+        """
+        return list(self.output_instances(output_collection))
+
+    def output_instances(self, output_collection):
+        """Generates, one at a time, what create_output_class_list()
+        returns so that they needn't all exist at once."""
+        for ip in output_collection:
+            if self.args['--stream']:  # IP_Summary instances are already
+                # joined.
+                yield self.ipDic[ip]
+                continue
+            # join them:
+            item_4_list = IP_Class(ip)
+            for f_name in self.ipDic[ip][lf]:
+                item_4_list.join(self.ipDic[ip][lf][f_name])
+            yield item_4_list
+
+    def remove_and_report_overlaps(self, sets, output_set, r, d):
+        """Returns report of overlapping IPs; removes them from output_set.
+    
+        Checks for IPs in output_set that are also in white or black input 
+        files, either as such or as part of a block (see ip_ranges.)
+        Any such IPs are reported and removed from output_set. 
+        Note: THIS IS A SIDE EFFECT on output_set (done at once.)
+        Returned is the report as an iterable of strings, possibly empty,
+        generated only as it is consumed.
+        Parameters 'r' & 'd' (from <args>) determine how much to report.
+        """
+        overlaps_by_file = {}  # Using a dict (vs set) to keep track of files.
+        overlaps = set()
+        listed = output_set & self.listed_ips  # Saves going through each
+        if listed:              # file's set if there's nothing to find.
+            for tup in sets.keys():
+                f_type, f_name = tup
+                if f_type != "--input":   # Must be white or black.
+                    if not sets[tup].isdisjoint(listed):  # Common IP exists.
+                        junk = overlaps_by_file.setdefault(tup, set())
+                        overlap =  output_set & sets[tup]
+                        overlaps |= overlap
+                        overlaps_by_file[tup] |= overlap
+        for tup, ranges in self.ip_ranges.items():
+            overlap = set([ip for ip in output_set
+                                        if self.range_key(ip) in ranges])
+            if overlap:
+                junk = overlaps_by_file.setdefault(tup, set())
+                overlaps |= overlap
+                overlaps_by_file[tup] |= overlap
+        output_set -= overlaps
+        return self.overlaps_report(overlaps_by_file, overlaps, r, d)
+
+    def overlaps_report(self, overlaps_by_file, overlaps, r, d):
+        """Generates the report returned by remove_and_report_overlaps()."""
+        if overlaps_by_file:
+            yield \
+    """The following IP addresses are being removed from the output 
+ because they appear in white or black input files as shown:
+"""
+            for tup in overlaps_by_file:
+                yield \
+    """#     Contents of file '{0[1]}' (type '{0[0]}'):
+""".format(tup)
+                ips = self.sorted_ips(overlaps_by_file[(tup)])
+                for ip in ips:
+                    yield "        {0}\n".format(self.ip_text(ip))
+            if (r or d):
+                yield "Requested details follow:\n"
+                for instance in self.output_instances(
+                                            self.sorted_ips(overlaps)):
+                    for line in instance.render(self, r, d):
+                        yield line
+
+    def preamble(self):
+        """Generates the part of the report which comes before anything
+        about the IPs: which files were opened, which couldn't be and which
+        had no IPs (unless -q/--quiet.)"""
+        # First: report successfully opened files.
+        if self.success_list and not self.args['--quiet']:
+            yield '\nThe following files were successfully opened for input:\n'
+            for f_name in self.success_list:
+                yield '\t{0}\n'.format(f_name)
+            yield '\n'
+
+        if not self.args['--quiet']:
+            # report file access errors
+            if self.err_message_list:
+                yield '\nFILE ACCESS ERRORS:\n'
+                for message in self.err_message_list:
+                    yield '{0}\n'.format(message)
+                yield 'End of file access errors report.\n'
+            # report files devoid of IP addresses.
+            yield '{0}\n'.format(report_empties(self.f_status_dic))
+
+    def output_ips(self):
+        """Returns the IPs to be output, in the order they are to be
+        output, and the report (an iterable of strings) of those which were
+        left out because they are white or black listed (see
+        remove_and_report_overlaps().)
+        Only those selected by --min-hits, --min-hosts, --burst and --top
+        are returned."""
+        args = self.args
+        with self.stage('sets'):
+            output_set = set(self.log_ips)  # See index_ip().
+        # The above is modified by next line.
+        with self.stage('overlaps'):
+            duplicate_deletion_report = \
+                    self.remove_and_report_overlaps(self.ip_index, output_set, 
+                        args['-r'], args['--demographics'])
+        removed = []  # Those removed are reported (see -v) and so need
+        if args['--demographics'] and args['--verbose']:  # demographics.
+            removed = [ip for ip in self.log_ips if ip not in output_set]
+        with self.stage('sort'):
+            if args['--min-hits'] > 1:
+                output_set = [ip for ip in output_set
+                    if self.order_by_frequency(ip)[0] >= args['--min-hits']]
+            if args['--min-hosts'] > 1:
+                local_ips = set().union(*[self.ip_index.get((lf, f_name, ), ())
+                                            for f_name in args['--input']])
+                output_set = [ip for ip in output_set
+                    if self.host_count(ip, local_ips) >= args['--min-hosts']]
+            if args['--burst']:
+                n, seconds = args['--burst']
+                output_set = [ip for ip in output_set
+                                    if self.max_burst(ip, seconds) >= n]
+            if args['--top']:  # The same as sorting and keeping the first K.
+                ips = heapq.nlargest(args['--top'], output_set,
+                                            key=self.order_by_frequency)
+                if not args['--frequency']:
+                    ips = self.sorted_ips(ips)
+            elif args['--frequency']:
+                ips = sorted(output_set, key=self.order_by_frequency,
+                                                            reverse=True)
+            else:
+                ips = self.sorted_ips(output_set)
+            if args['--packed'] and max(ips, default=0) <= akparser3.IP4_MAX:
+                ips = array.array('I', ips)  # Not if there's any IPv6.
+        if args['--demographics']:
+            # Look them all up now (concurrently) rather than one at a time
+            # as each is displayed.
+            to_look_up = [self.ip_text(ip) for ip in ips]
+            to_look_up.extend([self.ip_text(ip) for ip in removed])
+            with self.stage('demographics'):
+                self.demographics_getter.prefetch(to_look_up,
+                    workers=args['--demo-workers'], rate=args['--demo-rate'],
+                    retries=args['--demo-retries'])
+        return ips, duplicate_deletion_report
+
+    def generate_report(self):
+        """Generates the report, a piece at a time, so that each can be
+        written out as it is produced rather than the whole being first
+        assembled in memory.
+        """
+        args = self.args
+        yield '## LogParse REPORT ##\n'
+        for line in self.preamble():
+            yield line
+        ips, duplicate_deletion_report = self.output_ips()
+        if args['--verbose']:
+            # report 'white' or 'black' IPs removed from output.
+            for line in duplicate_deletion_report:
+                yield line
+
+        yield '\n## MAIN BODY of OUTPUT ##\n'
+        if args['-r'] > 1:
+            yield "__ IP Address __  _ # _   _Line Type_  +/- extra info\n"
+        elif args['-r'] == 1:
+            yield "__ IP Address __  _ # _\n"
+        else:
+            yield "__ IP Address __\n"
+
+        with self.stage('render'):  # Includes the writing of what's yielded.
+            for instance in self.output_instances(ips):
+                for line in instance.render(self, args['-r'],
+                                            args['--demographics']):
+                    yield line
+        yield "\n{0}\n".format(self.debug_report)
+
+    def generate_data(self, lines):
+        """Generates the output when --format is other than 'plain':
+        'lines' (one of the FORMATS) generates what is written for each of
+        the output IPs.  What would otherwise precede the main body of the
+        report goes to stderr instead (see preamble(), -v/--verbose.)"""
+        ips, duplicate_deletion_report = self.output_ips()
+        sys.stderr.writelines(self.preamble())
+        if self.args['--verbose']:
+            sys.stderr.writelines(duplicate_deletion_report)
+        with self.stage('render'):
+            for line in lines(ips):
+                yield line
+
+    def ipset6_name(self):
+        """The name of the set of IPv6 addresses (see --ipset.)"""
+        return self.args['--ipset'] + '-v6'
+
+    def ipset_lines(self, ips):
+        """Generates input for 'ipset -exist restore' which fills a new set
+        and swaps it for the one named by --ipset (which is created if need
+        be) so that the whole lot is replaced at once.  The same is done for
+        the IPv6 addresses (or networks) and the set named by ipset6_name()
+        which, being of type hash:net, can hold either.
+        Both sets of each pair are created with the same (--maxelem)
+        maxelem: swapping gives the set named by --ipset that of the new
+        set and 'create' (even with -exist) fails if it then differs.
+        Exits if there are more IPs than that."""
+        ips4 = []
+        ips6 = []
+        for ip in ips:
+            if self.is_ip6(ip):
+                ips6.append(ip)
+            else:
+                ips4.append(ip)
+        maxelem = self.args['--maxelem']
+        if max(len(ips4), len(ips6)) > maxelem:
+            sys.exit("{0} IPs won't fit in a set of --maxelem {1}.".format(
+                                        max(len(ips4), len(ips6)), maxelem))
+        for name, set_type, members in (
+                (self.args['--ipset'], "hash:ip family inet", ips4, ),
+                (self.ipset6_name(), "hash:net family inet6", ips6, ), ):
+            new_name = name + '-new'
+            create = "create {{0}} {0} maxelem {1}\n".format(set_type, maxelem)
+            yield create.format(name)
+            yield create.format(new_name)
+            yield "flush {0}\n".format(new_name)
+            line_format = "add {0} {{0}}\n".format(new_name)
+            for ip in members:
+                yield line_format.format(self.ip_text(ip))
+            yield "swap {0} {1}\n".format(new_name, name)
+            yield "destroy {0}\n".format(new_name)
+
+    def nft_lines(self, ips):
+        """Generates input for 'nft -f' which replaces the contents of the
+        set named by --ipset in the table named by --nft-table (both of
+        which are created if need be.)  nft applies the file as a single
+        transaction.  IPv6 addresses (or networks) go in a set named by
+        ipset6_name() of type ipv6_addr, with intervals (for networks.)"""
+        table = self.args['--nft-table']
+        yield "add table {0}\n".format(table)
+        for name, set_type, ip6 in (
+                (self.args['--ipset'], "type ipv4_addr;", False, ),
+                (self.ipset6_name(), "type ipv6_addr; flags interval;",
+                                                                True, ), ):
+            yield "add set {0} {1} {{ {2} }}\n".format(table, name, set_type)
+            yield "flush set {0} {1}\n".format(table, name)
+            elements = []
+            for ip in ips:
+                if self.is_ip6(ip) != ip6:
+                    continue
+                elements.append(self.ip_text(ip))
+                if len(elements) == _nft_elements_per_line:
+                    yield "add element {0} {1} {{ {2} }}\n".format(table,
+                                                name, ', '.join(elements))
+                    elements = []
+            if elements:
+                yield "add element {0} {1} {{ {2} }}\n".format(table, name,
+                                                        ', '.join(elements))
+
+    def json_lines(self, ips):
+        """Generates a JSON array with an object (see IP_Class.record())
+        for each IP, one per line."""
+        import json
+        yield '['
+        separator = '\n'
+        for instance in self.output_instances(ips):
+            yield separator
+            yield json.dumps(instance.record(self, self.args['-r'],
+                                             self.args['--demographics']))
+            separator = ',\n'
+        yield '\n]\n'
+
+    def csv_lines(self, ips):
+        """Generates CSV with a header line and then a line for each IP:
+        its address, count, the count for each line type, (with -t) when
+        first and last seen and (with -d) its demographics."""
+        args = self.args
+        import csv
+        import io
+        line_types = list(LINE_TYPE_INDEX)
+        demo_keys = ('Country', 'Region', 'City', 'ISP', )
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        header = ['ip', 'count'] + line_types
+        if args['--times']:
+            header.extend(('first_seen', 'last_seen', ))
+        if args['--demographics']:
+            header.extend(demo_keys)
+        writer.writerow(header)
+        for instance in self.output_instances(ips):
+            record = instance.record(self, 0, args['--demographics'])
+            row = [record['ip'], record['count']]
+            row.extend([record['line_types'].get(line_type, 0)
+                                                for line_type in line_types])
+            if args['--times']:
+                row.extend((record.get('first_seen', ''),
+                            record.get('last_seen', ''), ))
+            if args['--demographics']:
+                row.extend([record['demographics'][key] for key in demo_keys])
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Adds the wall clock and CPU time taken by the body of a
+        'with stage(name):' statement to stats['stages'][name]."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        times = self.stats['stages'].setdefault(name, [0.0, 0.0, ])
+        try:
+            yield
+        finally:
+            times[0] += time.perf_counter() - wall
+            times[1] += time.process_time() - cpu
+
+    def add_file_stats(self, f_name, n_lines, n_bytes, seconds):
+        """Adds to what stats['files'] has on f_name.  n_bytes is None
+        if not known (stdin.)"""
+        totals = self.stats['files'].setdefault(f_name, [0, 0, 0.0, ])
+        totals[0] += n_lines
+        if n_bytes is None:
+            totals[1] = None
+        elif totals[1] is not None:
+            totals[1] += n_bytes
+        totals[2] += seconds
+
+    def line_type_counts(self):
+        """Returns a dict keyed by line type (akparser3.LINE_TYPES and
+        _unclassified_IP_indicator) of how many log file lines of each type
+        were found, as gathered in ipDic."""
+        counts = {}
+        for ip in self.ipDic:
+            if self.args['--stream']:
+                for line_type, n in self.ipDic[ip].counts.items():
+                    counts[line_type] = counts.get(line_type, 0) + n
+                continue
+            for instance in self.ipDic[ip].get(lf, {}).values():
+                for line_type, i in LINE_TYPE_INDEX.items():
+                    if instance.counts[i]:
+                        counts[line_type] = (counts.get(line_type, 0)
+                                                        + instance.counts[i])
+        return counts
+
+    def stats_data(self):
+        """Returns all that --stats reports as a dict (see --stats-json.)"""
+        data = {'stages': {}, 'files': {}, }
+        for name, (wall, cpu) in self.stats['stages'].items():
+            data['stages'][name] = {'wall': wall, 'cpu': cpu}
+        for f_name, (n_lines, n_bytes, seconds) in self.stats['files'].items():
+            data['files'][f_name] = {'lines': n_lines, 'bytes': n_bytes,
+                                     'seconds': seconds,
+                'lines_per_second': n_lines / seconds if seconds else None,
+                'bytes_per_second': n_bytes / seconds
+                            if seconds and n_bytes is not None else None}
+        data['line_types'] = self.line_type_counts()
+        data['demographics'] = dict(getattr(self.demographics_getter,
+                                                            'stats', {}))
+        data['peak_rss'], data['workers_peak_rss'] = peak_rss()
+        if self.args['--jobs'] > 1 and resource:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            data['workers_cpu'] = usage.ru_utime + usage.ru_stime
+        else:
+            data['workers_peak_rss'] = None
+        return data
+
+    def stats_report(self, data):
+        """Generates, a line at a time, a report of stats_data()'s data."""
+        yield '\n## STATISTICS ##\n'
+        yield '{0:<20} {1:>10} {2:>10}\n'.format('Stage', 'Wall (s)',
+                                                        'CPU (s)')
+        for name, times in data['stages'].items():
+            yield '{0:<20} {1[wall]:>10.3f} {1[cpu]:>10.3f}\n'.format(
+                                                                name, times)
+        if data.get('workers_cpu'):
+            yield '{0:<20} {1:>10} {2:>10.3f}\n'.format('(workers)', '',
+                                                        data['workers_cpu'])
+        if data['files']:
+            yield '\n{0:<32} {1:>10} {2:>12} {3:>10}\n'.format('Input file',
+                                        'Lines', 'Lines/s', 'MB/s')
+            for f_name, info in data['files'].items():
+                yield '{0:<32} {1[lines]:>10} {2:>12} {3:>10}\n'.format(
+                    f_name, info,
+                    '{0:.0f}'.format(info['lines_per_second'])
+                        if info['lines_per_second'] is not None else '-',
+                    '{0:.2f}'.format(info['bytes_per_second'] / 1e6)
+                        if info['bytes_per_second'] is not None else '-')
+        yield '\n{0:<20} {1:>10}\n'.format('Line type', 'Lines')
+        for line_type in akparser3.LINE_TYPES + [_unclassified_IP_indicator]:
+            yield '{0:<20} {1:>10}\n'.format(line_type,
+                                    data['line_types'].get(line_type, 0))
+        demographics = data['demographics']
+        if self.args['--demographics'] and demographics:
+            yield '\nDemographics:\n'
+            for key in sorted(demographics):
+                yield '    {0:<18} {1:>10}\n'.format(key,
+                    round(demographics[key], 3))
+            if demographics.get('fetches'):
+                yield '    {0:<18} {1:>10.3f}\n'.format('mean_fetch_time',
+                    demographics['fetch_time'] / demographics['fetches'])
+        if data['peak_rss'] is not None:
+            yield '\nPeak RSS: {0:.1f} MB'.format(data['peak_rss'] / 1e6)
+            if data['workers_peak_rss']:
+                yield ' (largest worker: {0:.1f} MB)'.format(
+                                            data['workers_peak_rss'] / 1e6)
+            yield '\n'
+##### End of LogAnalyzer declaration. #####
+
+_min_chunk_size = 16 * 1024 * 1024  # Bytes. Smaller files aren't split.
+
+def file_chunks(f_type, f_name, chunk_size, start=0, end=None):
+    """Returns a list of (f_type, f_name, start, end, ) tuples
+    dividing up the file (or the part of it from start to end) into
+    pieces of about chunk_size bytes (see process_chunk().)"""
+    if end is None:
+        end = os.path.getsize(f_name)
+    if akparser3.compression_of(f_name):  # Can't be divided.
+        return [(f_type, f_name, start, end, )]
+    size = end - start
+    n_chunks = max(1, size // max(chunk_size, _min_chunk_size))
+    bounds = [start + size * i // n_chunks for i in range(n_chunks + 1)]
+    return [(f_type, f_name, bounds[i], bounds[i+1], )
+                                for i in range(n_chunks)]
+
+_forked = None  # Only set in a worker process (see start_worker().)
+
+def start_worker(analyzer):
+    """Runs in each worker process (see -j/--jobs) as it starts: keeps
+    (its copy of) the LogAnalyzer which started it for process_chunk().
+    Being passed to the worker, rather than set here beforehand, it
+    can't be changed by another LogAnalyzer (in another thread) starting
+    workers of its own."""
+    global _forked
+    _forked = analyzer
+
+def process_chunk(chunk):
+    """Runs in a worker process (see -j/--jobs.)
+
+    'chunk' is a tuple as returned by file_chunks() and so provides
+    the parameters for LogAnalyzer.process_range().  An empty copy of
+    the LogAnalyzer which started the workers (see _forked) reads it
+    and the (partial) ipDic, f_status_dic, ip_ranges and ip_times that
+    result are returned (see LogAnalyzer.merge_data()) followed by any
+    err_message_list entries (see LogAnalyzer.note_damaged().)
+    """
+    partial = copy.copy(_forked)  # Sharing the configuration.
+    partial.reset()
+    partial.err_message_list = []
+    partial.process_range(*chunk)
+    return (partial.ipDic, partial.f_status_dic, partial.ip_ranges,
+                                partial.ip_times, partial.err_message_list)
+
+def inotify_fd(file_names):
+    """Returns a (non blocking) inotify file descriptor which becomes
+    readable when anything changes in the directories holding
+    file_names (watching the directories also catches rotation) or
+    None if inotify is not available (it is Linux specific.)"""
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = 0x2 | 0x8 | 0x80 | 0x100  # IN_MODIFY, IN_CLOSE_WRITE,
+                                     # IN_MOVED_TO, IN_CREATE
+    for directory in set([os.path.dirname(os.path.abspath(f_name))
+                                        for f_name in file_names]):
+        libc.inotify_add_watch(fd, directory.encode(), mask)
+    return fd
 
 def report_empties(f_status_dic):
     """ Returns a report of input files containing no IP addresses.
@@ -317,21 +2026,6 @@ def report_empties(f_status_dic):
             ret += "\t'{0[1]}' (of type '{0[0]}')\n".format(tup)
     return ret
 
-def create_sets_by_tuple(ipDic):
-    """Returns a dictionary with values as sets, 
-    keyed by (f_type, f_name, ) tuples. 
-    The sets contain the IPs gleaned from that 
-    particular file.
-    """
-    sets = {} 
-    for ip in ipDic:
-        for f_type in ipDic[ip]:
-            for f_name in ipDic[ip][f_type]:
-                tup = (f_type, f_name, )
-                junk = sets.setdefault(tup, set()  )
-                sets[tup].add(ip)
-    return sets
-
 def raw_output_set(sets):
     """Returns the set of IPs in input/log files."""
     ret_set = set()
@@ -340,150 +2034,235 @@ def raw_output_set(sets):
             ret_set |= sets[(f_type, f_name, )]
     return ret_set
 
-def create_output_class_list(output_collection):
-    """Sets up the list of IP_Class instances for output.
-    
-    Assumes output_collection contains IPs that were found 
-    in an input log file and therefore will have IP_Class 
-    instances associated with corresponding entries in ipDic.
-    Note that 'output_collection' can be any iterable whose 
-    values are IPs that exist in ipDic with a log file index.
-    """
-    output_list = []
-    for ip in output_collection:
-        # join them:
-        item_4_list = IP_Class(ip)
-        for f_name in ipDic[ip][lf]:
-            item_4_list.join(ipDic[ip][lf][f_name])
-        output_list.append(item_4_list)
-    return output_list
-
-def remove_and_report_overlaps(sets, output_set, r, d):
-    """Returns report of overlapping IPs; removes them from output_set.
-    
-    Checks for IPs in output_set that are also in white or black input 
-    files. Any such IPs are reported and removed from output_set. 
-    Note: THIS IS A SIDE EFFECT on output_set.
-    Returned is either the report, or an empty string.
-    Parameters 'r' & 'd' (from <args>) determine how much to report.
-    """
-    ret = ""
-    overlaps_by_file = {}  # Using a dict (vs set) to keep track of files.
-    overlaps = set()
-    for tup in sets.keys():
-        f_type, f_name = tup
-        if f_type != "--input":   # Must be white or black.
-            if not sets[tup].isdisjoint(output_set):  # Common IP exists.
-                junk = overlaps_by_file.setdefault(tup, set())
-                overlap =  output_set & sets[tup]
-                overlaps |= overlap
-                overlaps_by_file[tup] |= overlap
-    list_of_overlapping_instances = create_output_class_list(overlaps)
-    if overlaps_by_file:
-        ret = ret + \
-"""The following IP addresses are being removed from the output 
- because they appear in white or black input files as shown:
-"""
-        for tup in overlaps_by_file:
-            ret = ret + \
-"""#     Contents of file '{0[1]}' (type '{0[0]}'):
-""".format(tup)
-            ips = sorted(overlaps_by_file[(tup)], key=akparser3.sortable_ip)
-            for ip in ips:
-                ip_class_instance = ipDic[ip][tup[0]][tup[1]]
-                ret += "        {0}\n".format(ip)
-        output_set -= overlaps
-        if (r or d):
-            ret += "Requested details follow:\n"
-            for instance in list_of_overlapping_instances:
-                ret += instance.display(r, d)
-    return ret
+## Snapshots (see --export, --import and --merge) are sqlite files with
+## a table 'snapshot' holding a row for each IP and host: 'ip' (IPv4 as
+## an integer, IPv6 as text,) 'host', 'count', a count for each line
+## type (the keys of LINE_TYPE_INDEX) and 'first_seen' and 'last_seen'
+## (NULL unless gathered with -t/--times.)
+_snapshot_version = 1
 
-####***************  __main__  begins here.  ***************#####
+def snapshot_columns():
+    """Returns the names of a snapshot's columns (quoted for SQL.)"""
+    return (['ip', 'host', 'count']
+            + ['"{0}"'.format(line_type) for line_type in LINE_TYPE_INDEX]
+            + ['first_seen', 'last_seen'])
 
-#print(args)  ### Comment out after debugging.
+def create_snapshot(db, table='snapshot'):
+    """Creates an empty snapshot table (and 'info' table) in db."""
+    db.execute("CREATE TABLE {0} (ip, host TEXT, count INTEGER, {1}, "
+        "first_seen INTEGER, last_seen INTEGER)".format(table,
+        ', '.join(['{0} INTEGER'.format(column)
+                                for column in snapshot_columns()[3:-2]])))
+    if table == 'snapshot':
+        db.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value)")
+        db.executemany("INSERT INTO info VALUES (?, ?)",
+                (('version', _snapshot_version, ),
+                 ('created', int(time.time()), ), ))
 
-for arg_file_type in arg_file_types:
-    for f_name in args[arg_file_type]:
-        if f_name == 'sys.stdin':
-            f = sys.stdin
-        else:
-            try:
-                f = open(f_name, 'r', encoding='utf-8')
-            except IOError as err_report:
-                err_message_list.append(err_report)
-                continue
-        for line in f:
-            line = line.strip()
-            if line:
-                process(line, arg_file_type, f_name)
-        if f_name != 'sys.stdin':
-            f.close()
-        success_list.append(f_name)
-
-# Begin Report Creation:
-# First: report successfully opened files.
-if success_list and not args['--quiet']:
-    success_report += \
-    '\nThe following files were successfully opened for input:\n'
-    for f_name in success_list:
-        success_report += '\t{0}\n'.format(f_name)
-    success_report += '\n'
-
-report = '## LogParse REPORT ##\n{0}'.format(success_report)
-
-if not args['--quiet']:
-    # report file access errors
-    if err_message_list:
-        report += '\nFILE ACCESS ERRORS:\n'
-        for message in err_message_list:
-            report += '{0}\n'.format(message)
-        report += 'End of file access errors report.\n'
-    # report files devoid of IP addresses.
-    report += '{0}\n'.format(report_empties(f_status_dic))
-
-sets_by_tuple =  create_sets_by_tuple(ipDic)
-output_set = raw_output_set(sets_by_tuple)  
-# The above is likely modified by next line.
-duplicate_deletion_report = \
-            remove_and_report_overlaps(sets_by_tuple, output_set, 
-                args['-r'], args['--demographics'])
-if args['--verbose']:
-    # report 'white' or 'black' IPs removed from output.
-    report += duplicate_deletion_report
-
-report += '\n## MAIN BODY of OUTPUT ##\n'
-if args['-r'] > 1:
-    report += "__ IP Address __  _ # _   _Line Type_  +/- extra info\n"
-elif args['-r'] == 1:
-    report += "__ IP Address __  _ # _\n"
-else:
-    report += "__ IP Address __\n"
-
-ips = list(output_set)
-if args['--frequency']:
-    ips.sort(key=order_by_frequency, reverse=True)
-else:
-    ips.sort(key=akparser3.sortable_ip)
-class_list = create_output_class_list(ips)
-
-for instance in class_list:
-    report += instance.display(args['-r'], args['--demographics'])
-
-if args["--output"]=='stdout':
-    outF = sys.stdout
-else:
+def write_snapshot(file_name, fill):
+    """Creates the snapshot file_name: fill(db) adds its rows.  The
+    file only replaces any already there once complete."""
+    import sqlite3
+    temporary = file_name + '.new'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    db = sqlite3.connect(temporary)
+    try:
+        create_snapshot(db)
+        fill(db)
+        db.commit()
+    except:
+        db.close()
+        os.remove(temporary)
+        raise
+    db.close()
+    os.replace(temporary, file_name)
+
+def open_snapshot(db, file_name, name):
+    """Attaches the snapshot file_name to db as 'name'.  Returns the
+    columns (of those of snapshot_columns()) which it has: at least
+    'ip', 'host' and 'count', perhaps no line types.  Raises ValueError
+    if it isn't a snapshot."""
+    if not os.path.isfile(file_name):  # Else sqlite would create it.
+        raise ValueError("Snapshot '{0}' not found.".format(file_name))
+    import sqlite3
+    not_snapshot = ValueError("'{0}' is not a snapshot.".format(file_name))
+    try:
+        db.execute("ATTACH DATABASE ? AS {0}".format(name), (file_name, ))
+    except sqlite3.DatabaseError:
+        raise not_snapshot
     try:
-        outF = open(args["--output"], 'w', encoding='utf-8')
-    except IOError as err_report:
-        print("Unable to open output file '{0}'.".\
-                                            format(args["--output"]) )
-        print("Error report: '{0}'.".format(err_report))
-        print("Out put is being sent instead to stdout.")
+        present = set(['"{0}"'.format(row[1]) if row[1] in LINE_TYPE_INDEX
+                        else row[1] for row in db.execute(
+                            "PRAGMA {0}.table_info(snapshot)".format(name))])
+    except sqlite3.DatabaseError:  # Not an sqlite file.
+        present = set()
+    if not set(['ip', 'host', 'count']) <= present:
+        db.execute("DETACH DATABASE {0}".format(name))
+        raise not_snapshot
+    return [column for column in snapshot_columns() if column in present]
+
+def merge_snapshots(file_name, snapshots):
+    """Writes to file_name the snapshot combining those named by
+    snapshots (see --merge): a row for each IP and host with the sums
+    of their counts and the earliest and latest times seen.  Each
+    snapshot is copied into a single table, by sqlite, which is then
+    reduced by one GROUP BY.  Raises ValueError as open_snapshot()."""
+    columns = snapshot_columns()
+
+    def fill(db):
+        create_snapshot(db, 'temp.rows')
+        for f_name in snapshots:
+            present = ', '.join(open_snapshot(db, f_name, 'source'))
+            db.execute("INSERT INTO temp.rows ({0}) SELECT {0} FROM "
+                       "source.snapshot".format(present))
+            db.commit()  # Can't detach during a transaction.
+            db.execute("DETACH DATABASE source")
+        db.execute("INSERT INTO snapshot SELECT ip, host, {0}, "
+                   "MIN(first_seen), MAX(last_seen) FROM temp.rows "
+                   "GROUP BY ip, host".format(', '.join(
+                   ['SUM({0})'.format(column)
+                                        for column in columns[2:-2]])))
+    write_snapshot(file_name, fill)
+
+_nft_elements_per_line = 1000
+
+FORMATS = {'ipset': 'ipset_lines', 'nft': 'nft_lines', 'json': 'json_lines',
+           'csv': 'csv_lines', }  # See --format: LogAnalyzer methods.
+
+def parse_when(text):
+    """Returns the time given by text (see --since) in seconds as
+    akparser3.timestamp() would.  Raises ValueError if it isn't one."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, }
+    if text[-1:] in units and text[:-1].isdigit():  # How long ago.
+        return (calendar.timegm(time.localtime())
+                    - int(text[:-1]) * units[text[-1]])
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
+                                                        '%Y-%m-%d', ):
+        try:
+            return calendar.timegm(time.strptime(text, time_format))
+        except ValueError:
+            pass
+    raise ValueError("'{0}' is not a time.".format(text))
+
+def parse_size(text):
+    """Returns the number of bytes given by text (see --min-size.)
+    Raises ValueError if it isn't one."""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, }
+    if text[-1:].upper() in units:
+        return int(text[:-1]) * units[text[-1:].upper()]
+    return int(text)
+
+def peak_rss():
+    """Returns the peak resident set size (in bytes) of this process
+    and of the largest of its children (-j/--jobs workers,) or
+    (None, None, )."""
+    if not resource:
+        return None, None
+    scale = 1 if sys.platform == 'darwin' else 1024  # Else in KiB.
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def main(argv=None):
+    """Does what the command line (argv, by default sys.argv[1:]) asks
+    (see __doc__.)  Returns the LogAnalyzer used (None with --merge.)"""
+    args = parse_args(argv)
+    if args['--merge']:
+        try:
+            merge_snapshots(args['--merge'], args['<snapshot>'])
+        except ValueError as err_report:
+            sys.exit(err_report)
+        return None
+    if args['--import'] and args['--export']:
+        sys.exit("--export can't be used with --import (see --merge.)")
+    if args['--import'] and args['--input'] == ['sys.stdin']:
+        args['--input'] = []
+    analyzer = LogAnalyzer(args)
+    with analyzer.stage('find input files'):
+        args['--input'] = analyzer.input_files(args['--input'])
+    if args['--state']:
+        analyzer.load_state(args['--state'])
+    if args['--follow']:
+        if args["--output"]=='stdout':
+            outF = sys.stdout
+        else:
+            outF = open(args["--output"], 'a', encoding='utf-8')
+        analyzer.read_files([wf, bf])
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+        try:
+            analyzer.follow(outF)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if args['--state']:
+                analyzer.save_state(args['--state'])
+        return analyzer
+    if args['--profile']:
+        import cProfile
+        profiler = cProfile.Profile()
+    for types in ([lf], [wf, bf]):
+        with analyzer.stage('read input' if types == [lf]
+                                            else 'read white/black'):
+            if args['--profile'] and types == [lf]:
+                profiler.enable()
+            if args['--jobs'] > 1:
+                analyzer.read_files_in_parallel(args['--jobs'], types)
+            else:
+                analyzer.read_files(types)
+            if args['--profile'] and types == [lf]:
+                profiler.disable()
+                profiler.dump_stats(args['--profile'])
+        if args['--state'] and types == [lf]:
+            with analyzer.stage('save state'):
+                analyzer.save_state(args['--state'])
+    if args['--export']:
+        with analyzer.stage('export snapshot'):
+            analyzer.export_snapshot(args['--export'])
+    if args['--import']:
+        with analyzer.stage('import snapshots'):
+            for f_name in args['--import']:
+                try:
+                    analyzer.import_snapshot(f_name)
+                except ValueError as err_report:
+                    analyzer.err_message_list.append(err_report)
+
+    # Report Creation: written out as it is generated.
+    if args["--output"]=='stdout':
         outF = sys.stdout
-outF.write(report)
-outF.write("\n{0}\n".format(debug_report))
-outF.close()
+    else:
+        try:
+            outF = open(args["--output"], 'w', encoding='utf-8')
+        except IOError as err_report:
+            print("Unable to open output file '{0}'.".\
+                                                format(args["--output"]) )
+            print("Error report: '{0}'.".format(err_report))
+            print("Out put is being sent instead to stdout.")
+            outF = sys.stdout
+    if args['--format'] == 'plain':
+        outF.writelines(analyzer.generate_report())
+    else:
+        outF.writelines(analyzer.generate_data(
+                            getattr(analyzer, FORMATS[args['--format']])))
+    if args['--stats'] or args['--stats-json']:
+        data = analyzer.stats_data()
+        if args['--stats'] and args['--format'] == 'plain':
+            outF.writelines(analyzer.stats_report(data))
+        elif args['--stats']:
+            sys.stderr.writelines(analyzer.stats_report(data))
+        if args['--stats-json']:
+            import json
+            with open(args['--stats-json'], 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+                f.write('\n')
+    outF.close()
+    analyzer.close()
+    return analyzer
+
+####***************  __main__  begins here.  ***************#####
+
+if __name__ == "__main__":
+    main()
 
 notes = """
 # After input is collected must process:
@@ -508,15 +2287,14 @@ notes = """
 
 IP_Class provides:
   * a counter accessible using methods incriment() and how_many()
-  * 'other' which is a dictionary keyed by LINE_TYPES 
-     with values which are lists of lists containing log info.
+  * 'counts' (per log entry type) and 'gleaned' (the log info.)
      These a accessed using methods
      add_other(tuple: (log_entry_type, list_of_values, ) )
      keys()  # returns the keys (log_entry_types)
      values(key: a log_entry_type)  
         # returns a list of lists
         # one list for each instance of the key found 
-        # in the log files.
+        # in the log files (or a count if there is no info.)
 
 report_empties() Reports files devoid of IP addresses. 
 create_sets_by_tuple()  dictionary keyed by (f_type, f_name, )
@@ -0,0 +1,234 @@
+"""Tests of akparser3's demographics look ups (DemographicsCache and
+IpDemographics) against a stand in for the web site, run locally, and
+of its readers and tables."""
+
+import http.server
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+import akparser3
+
+PAGE = """<html><head><meta charset="utf-8"></head><body><table>
+<tr><td>IP:&nbsp;</td><td>{ip}</td></tr>
+<tr><td>Country:&nbsp;</td><td>Testland</td></tr>
+<tr><td>Region:&nbsp;</td><td>North</td></tr>
+<tr><td>City:&nbsp;</td><td>Springfield</td></tr>
+<tr><td>Latitude:&nbsp;</td><td>12.5</td></tr>
+<tr><td>Longitude:&nbsp;</td><td>-3.25</td></tr>
+<tr><td>ISP name:&nbsp;</td><td>Example ISP</td></tr>
+<tr><td>Organization name:&nbsp;</td><td>Example Org</td></tr>
+</table></body></html>"""
+
+
+class StubSite(http.server.ThreadingHTTPServer):
+
+    """Answers as the 'addgadgets' service would.  'failures' maps
+    an IP to a list of HTTP status codes to return (one per request)
+    before answering normally.  'requests' records each IP asked for
+    and when."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url_template(self):
+        return "http://127.0.0.1:{0}/?ipaddr={{0}}".format(
+                                                self.server_address[1])
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        query = urllib.parse.urlparse(self.path).query
+        ip = urllib.parse.parse_qs(query)['ipaddr'][0]
+        with self.server.lock:
+            self.server.requests.append((ip, time.time()))
+            failures = self.server.failures.get(ip)
+            status = failures.pop(0) if failures else 200
+        if status != 200:
+            self.send_error(status)
+            return
+        body = PAGE.format(ip=ip).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = StubSite()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'cache.sqlite')
+
+
+def demographics(site, cache=None):
+    getter = akparser3.IpDemographics(cache=cache, timeout=5)
+    getter.url_template = site.url_template
+    return getter
+
+
+class Clock(object):
+    """Stands in for time.time() in the cache."""
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(akparser3.time, 'time', clock)
+    return clock
+
+
+def test_ip_info_from_site(site):
+    info = demographics(site).ip_info('192.0.2.1')
+    assert info['err'] == ''
+    assert info['IP'] == '192.0.2.1'
+    assert info['City'] == 'Springfield'
+    assert info['ISP'] == 'Example ISP'
+
+
+def test_cache_hit_on_second_run(site, cache_path):
+    cache = akparser3.DemographicsCache(cache_path)
+    first = demographics(site, cache).ip_info('192.0.2.1')
+    cache.close()
+    cache = akparser3.DemographicsCache(cache_path)
+    getter = demographics(site, cache)
+    assert getter.ip_info('192.0.2.1') == first
+    cache.close()
+    assert len(site.requests) == 1
+    assert getter.stats['cache_hits'] == 1
+    assert getter.stats['cache_misses'] == 0
+
+
+def test_cache_expiry(clock, cache_path):
+    info = dict.fromkeys(akparser3.IpDemographics.demo_keys, '')
+    cache = akparser3.DemographicsCache(cache_path, ttl=100,
+                                                negative_ttl=10)
+    cache.put('192.0.2.1', 'addgadgets', info)
+    cache.put('192.0.2.2', 'addgadgets', dict(info, err='timed out'))
+    clock.now += 50
+    assert cache.get('192.0.2.1', 'addgadgets') == info
+    assert cache.get('192.0.2.2', 'addgadgets') is None  # Failed.
+    clock.now += 51
+    assert cache.get('192.0.2.1', 'addgadgets') is None
+    assert cache.get('192.0.2.1', 'hostip') is None
+    cache.close()
+
+
+def test_cache_eviction(clock, cache_path):
+    info = dict.fromkeys(akparser3.IpDemographics.demo_keys, '')
+    cache = akparser3.DemographicsCache(cache_path, max_entries=2)
+    for ip in ('192.0.2.1', '192.0.2.2', '192.0.2.3'):
+        cache.put(ip, 'addgadgets', info)
+        clock.now += 1
+    assert cache.get('192.0.2.1', 'addgadgets') == info  # Now recent.
+    cache.flush()
+    assert cache.get('192.0.2.2', 'addgadgets') is None
+    cache.close()
+    cache = akparser3.DemographicsCache(cache_path, max_entries=2)
+    assert cache.get('192.0.2.1', 'addgadgets') == info
+    assert cache.get('192.0.2.3', 'addgadgets') == info
+    cache.close()
+
+
+IPS = ['192.0.2.{0}'.format(n) for n in range(1, 9)]
+
+
+def test_prefetch(site):
+    getter = demographics(site)
+    getter.prefetch(IPS, workers=4)
+    assert sorted(ip for ip, when in site.requests) == sorted(IPS)
+    for ip in IPS:
+        assert getter.ip_info(ip)['IP'] == ip
+    assert len(site.requests) == len(IPS)  # ip_info() used prefetched.
+
+
+def test_prefetch_rate_limited(site):
+    getter = demographics(site)
+    getter.prefetch(IPS, workers=4, rate=20)
+    times = sorted(when for ip, when in site.requests)
+    assert times[-1] - times[0] >= (len(IPS) - 1) / 20 - 0.02
+
+
+def test_prefetch_retries_server_errors(site):
+    site.failures = {IPS[0]: [503, 500], IPS[1]: [503, 503, 503],
+                     IPS[2]: [404]}
+    getter = demographics(site)
+    getter.prefetch(IPS[:3], workers=3, retries=2, backoff=0.01)
+    asked = [ip for ip, when in site.requests]
+    assert asked.count(IPS[0]) == 3
+    assert getter.ip_info(IPS[0])['err'] == ''
+    assert asked.count(IPS[1]) == 3
+    assert getter.ip_info(IPS[1])['err'].code == 503
+    assert asked.count(IPS[2]) == 1  # A 4xx isn't retried.
+    assert getter.ip_info(IPS[2])['err'].code == 404
+
+
+def test_prefetch_uses_cache_on_second_run(site, cache_path):
+    cache = akparser3.DemographicsCache(cache_path)
+    demographics(site, cache).prefetch(IPS, workers=4)
+    cache.close()
+    cache = akparser3.DemographicsCache(cache_path)
+    getter = demographics(site, cache)
+    getter.prefetch(IPS + ['192.0.2.99'], workers=4)
+    cache.close()
+    assert len(site.requests) == len(IPS) + 1
+    assert getter.stats['cache_hits'] == len(IPS)
+    assert getter.stats['cache_misses'] == 1
+    assert getter.ip_info(IPS[0])['City'] == 'Springfield'
+
+
+def test_background_reader_closed_early(tmp_path):
+    """Closing before the end stops the decompressing thread (which
+    would otherwise wait for ever for room in its queue.)"""
+    import gzip
+    path = str(tmp_path / 'auth.log.gz')
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for n in range(200000):  # Well over the queue's 4MB.
+            f.write("Jan  3 06:25:01 host sshd[{0}]: Invalid user admin "
+                    "from 203.0.113.5 port 4211\n".format(n))
+    threads = threading.active_count()
+    with akparser3.open_log(path, background=True) as f:
+        assert '203.0.113.5' in f.readline()
+        time.sleep(0.2)  # Time for the queue to fill.
+    assert threading.active_count() == threads
+
+
+def test_ip_ranges_kept_apart_by_family():
+    """240.0.0.0/4 ends at IP4_MAX and ::/8 begins just after it: they
+    must not be merged into one interval."""
+    ranges = akparser3.IpRanges(akparser3.get_ip_ranges(
+                                            "240.0.0.0/4 ::/8"))
+    assert len(ranges) == 2
+    assert '255.255.255.255' in ranges
+    assert '240.0.0.0' in ranges
+    assert '239.255.255.255' not in ranges
+    assert '::1' not in ranges  # In ::/96, not taken as IPv6.
+    assert '0:ff::1' in ranges
+    assert '100::1' not in ranges
+    ranges.add(*akparser3.ip_block('10.0.0.0/8'))
+    assert '10.1.2.3' in ranges and len(ranges) == 3
@@ -0,0 +1,121 @@
+"""Tests of logparser3's report against those kept in testdata/: they
+were made before IP_Class kept its data in slots and arrays and the
+report must still be the same, byte for byte, however it is gathered.
+Also of what --state makes of rotated files."""
+
+import json
+import os
+
+import pytest
+
+import logparser3
+
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                        'testdata')
+# auth.log.1 and auth.log share IPs (and some gleaned user names) so
+# their IP_Class instances must be joined for the report.
+FILES = ['--white', 'white.txt', '--black', 'black.txt',
+         '--input', 'auth.log.1', '--input', 'auth.log',
+         '--input', 'fail2ban.log']
+
+
+def report(tmp_path, options):
+    output = str(tmp_path / 'report.txt')
+    logparser3.main(options + FILES + ['--output', output])
+    with open(output, encoding='utf-8') as f:
+        return f.read()
+
+
+def expected(name):
+    with open(os.path.join(TESTDATA, name), encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture(autouse=True)
+def in_testdata(monkeypatch):
+    monkeypatch.chdir(TESTDATA)  # The report names the files as given.
+
+
+@pytest.mark.parametrize('options', [[], ['-p'], ['--mmap'],
+                                     ['--pipeline'], ['-j', '2']])
+def test_report(tmp_path, options):
+    assert report(tmp_path, ['-rr'] + options) == expected('report_rr.txt')
+
+
+@pytest.mark.parametrize('options', [[], ['-p'], ['-j', '2']])
+def test_report_by_frequency(tmp_path, options):
+    assert (report(tmp_path, ['-rr', '-f'] + options)
+                                    == expected('report_rr_f.txt'))
+
+
+def test_join():
+    first = logparser3.IP_Class('203.0.113.5')
+    first.add_other(('invalid_user', [('oracle', )]))
+    first.add_other(('invalid_user', [('root', )]))
+    first.add_other(None)
+    second = logparser3.IP_Class('203.0.113.5')
+    second.add_other(('invalid_user', [('admin', )]))
+    second.add_other(('invalid_user', [('oracle', )]))
+    second.add_other(('ban', None))
+    for instance in (first, second):
+        for i in range(3):
+            instance.increment()
+    first.join(second)
+    assert first.how_many() == 6
+    assert sorted(first.keys()) == ['ban', 'invalid_user', 'solo-IP']
+    assert first.values('ban') == 1
+    assert first.values('solo-IP') == 1
+    assert first.values('invalid_user') == [
+        (('oracle', ), ), (('root', ), ), (('admin', ), ), (('oracle', ), )]
+
+
+def test_join_large_counts():
+    """Imported (see --import) sums can pass 2**32."""
+    first = logparser3.IP_Class('203.0.113.5')
+    second = logparser3.IP_Class('203.0.113.5')
+    index = logparser3.LINE_TYPE_INDEX['ban']
+    first.counts[index] = 2 ** 32 - 1
+    second.counts[index] = 2
+    first.join(second)
+    assert first.values('ban') == 2 ** 32 + 1
+
+
+LINE = ("Jan  3 06:25:0{0} host sshd[10{0}]: Invalid user admin "
+        "from 203.0.113.5 port 421{0}\n")
+
+
+def counts(tmp_path, options):
+    """Returns the count of each IP (see --format json.)"""
+    output = str(tmp_path / 'report.json')
+    logparser3.main(options + ['--format', 'json', '--output', output])
+    with open(output, encoding='utf-8') as f:
+        return {record['ip']: record['count'] for record in json.load(f)}
+
+
+def test_state_follows_rotated_file(tmp_path):
+    logs = tmp_path / 'rot'
+    logs.mkdir()
+    with open(str(logs / 'auth.log'), 'w') as f:
+        f.writelines([LINE.format(n) for n in range(4)])
+    options = ['-r', '--state', str(tmp_path / 'state'),
+                                            '--input', str(logs)]
+    assert counts(tmp_path, options) == {'203.0.113.5': 4}
+    os.rename(str(logs / 'auth.log'), str(logs / 'auth.log.1'))
+    with open(str(logs / 'auth.log'), 'w') as f:
+        f.write(LINE.format(5))
+    assert counts(tmp_path, options) == {'203.0.113.5': 5}
+    with open(str(logs / 'auth.log.1'), 'a') as f:  # Written to after
+        f.write(LINE.format(6))                   # being renamed.
+    assert counts(tmp_path, options) == {'203.0.113.5': 6}
+
+
+def test_black_list_of_bogons(tmp_path):
+    """A black file with IPv4 and IPv6 blocks which meet (see
+    akparser3.IpRanges.merge().)"""
+    black = str(tmp_path / 'bogon.txt')
+    with open(black, 'w') as f:
+        f.write("240.0.0.0/4\n::/8\n198.51.100.0/24\n")
+    assert counts(tmp_path, ['-r', '--input', 'auth.log',
+                             '--black', black]) == {
+        '0.0.0.0': 1, '10.9.8.7': 1, '192.0.2.44': 1, '192.168.1.2': 1,
+        '192.168.1.10': 1, '203.0.113.5': 4}